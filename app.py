@@ -1,41 +1,514 @@
+import click
+import contextlib
+import fcntl
+import functools
+import hashlib
+import hmac
+import io
+import itertools
+import logging
+import multiprocessing
 import os
+import random
+import re
+import sqlite3
+import tempfile
+import threading
 import time
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+import tracemalloc
+from flask import Blueprint, Flask, Response, current_app, render_template, request, redirect, url_for, flash, session, abort, g, has_request_context, send_from_directory
+from flask.signals import before_render_template, template_rendered
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from flask_sqlalchemy.session import Session
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import generate_password_hash
+from itsdangerous import URLSafeSerializer, BadSignature
 from datetime import datetime
+from collections import Counter, OrderedDict
+from types import SimpleNamespace
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import json
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
+import benchmark
+import imaging
+import memory
+import metrics
+import passwords
+import profiling
+import slow_queries
+import synthetic
+import tracing
 
-# Use PostgreSQL from Render
-database_url = os.environ.get('DATABASE_URL')
+# Routes, filters, hooks and CLI commands; registered on the app by create_app()
+bp = Blueprint('main', __name__, cli_group=None)
 
-if not database_url:
-    raise ValueError("DATABASE_URL environment variable is required")
+def normalize_database_url(url):
+    """Fix the URL format for SQLAlchemy + force psycopg3"""
+    if url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql+psycopg://", 1)
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+psycopg://", 1)
+    return url
 
-# Fix the URL format for SQLAlchemy + force psycopg3
-if database_url.startswith("postgres://"):
-    database_url = database_url.replace("postgres://", "postgresql+psycopg://", 1)
-elif database_url.startswith("postgresql://"):
-    database_url = database_url.replace("postgresql://", "postgresql+psycopg://", 1)
+# A named, shared-cache in-memory database: every connection in the process
+# opens the same one, and it lives as long as any of them is open
+MEMORY_DATABASE = 'file:rentit?mode=memory&cache=shared'
+MEMORY_DATABASE_URL = 'sqlite:///file:rentit?mode=memory&cache=shared&uri=true'
 
+def embedded_database_url(path):
+    if path == ':memory:':
+        return MEMORY_DATABASE_URL
+    return f'sqlite:///{os.path.abspath(path)}'
 
-app.config['SQLALCHEMY_DATABASE_URI'] = database_url
-print(f"✅ Using PostgreSQL with psycopg3")
+def is_in_memory(url):
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and (url.database in (None, '', ':memory:')
+                                                   or url.query.get('mode') == 'memory')
 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['UPLOAD_FOLDER'] = 'static/uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+def load_config(config, overrides):
+    """Read settings from the environment, then apply explicit overrides"""
+    config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
+    
+    # Use PostgreSQL from Render, or an embedded SQLite database (a file path
+    # or ':memory:') for local runs, CI and benchmarks
+    config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
+    config['EMBEDDED_DB'] = os.environ.get('EMBEDDED_DB')
+    
+    # Optional read replicas (comma-separated URLs), registered as binds
+    # 'replica0', 'replica1', ... and used only by views marked @read_only
+    replica_urls = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    config['SQLALCHEMY_BINDS'] = {
+        f'replica{i}': normalize_database_url(url) for i, url in enumerate(replica_urls)
+    }
+    config['REPLICA_STICKY_SECONDS'] = int(os.environ.get('REPLICA_STICKY_SECONDS', '10'))
+    config['REPLICA_HEALTH_INTERVAL'] = int(os.environ.get('REPLICA_HEALTH_INTERVAL', '10'))
+    
+    config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    config['UPLOAD_FOLDER'] = 'static/uploads'
+    config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+    config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', '2'))
+    config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    config['HASH_WORKERS'] = int(os.environ.get('HASH_WORKERS', '2'))
+    config['HASH_QUEUE_DEPTH'] = int(os.environ.get('HASH_QUEUE_DEPTH', '8'))
+    config['HASH_TIMEOUT'] = float(os.environ.get('HASH_TIMEOUT', '5'))
+    config['HOMEPAGE_CACHE_TTL'] = int(os.environ.get('HOMEPAGE_CACHE_TTL', '60'))
+    config['SEARCH_PAGE_SIZE'] = int(os.environ.get('SEARCH_PAGE_SIZE', '24'))
+    config['SEARCH_COUNT_CAP'] = int(os.environ.get('SEARCH_COUNT_CAP', '1000'))
+    config['SEARCH_CACHE_TTL'] = int(os.environ.get('SEARCH_CACHE_TTL', '30'))
+    config['SEARCH_CACHE_SIZE'] = int(os.environ.get('SEARCH_CACHE_SIZE', '1000'))
+    config['SEARCH_SIMILARITY_THRESHOLD'] = float(os.environ.get('SEARCH_SIMILARITY_THRESHOLD', '0.5'))
+    
+    # Connection pool
+    config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', '5'))
+    config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', '10'))
+    config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', '30'))
+    config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+    config['DB_POOL_PRE_PING'] = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    config['DB_STATEMENT_TIMEOUT_MS'] = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', '30000'))
+    config['DB_POOL_WAIT_WARN_MS'] = float(os.environ.get('DB_POOL_WAIT_WARN_MS', '100'))
+    
+    # Per-request query checks (0 disables). Violations raise in debug and
+    # testing, and are logged otherwise, unless QUERY_BUDGET_STRICT says so.
+    config['QUERY_BUDGET'] = int(os.environ.get('QUERY_BUDGET', '20'))
+    config['QUERY_REPEAT_LIMIT'] = int(os.environ.get('QUERY_REPEAT_LIMIT', '5'))
+    strict = os.environ.get('QUERY_BUDGET_STRICT')
+    config['QUERY_BUDGET_STRICT'] = None if strict is None else strict.lower() == 'true'
+    config['QUERY_LOG'] = os.environ.get('QUERY_LOG', 'false').lower() == 'true'
+    
+    # Statements slower than SLOW_QUERY_MS (0 disables) are logged and
+    # aggregated per worker for /admin/slow-queries; SLOW_QUERY_EXPLAIN adds
+    # the plan of each SELECT, fetched in the background on its own connection
+    config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', '500'))
+    config['SLOW_QUERY_MAX_FINGERPRINTS'] = int(os.environ.get('SLOW_QUERY_MAX_FINGERPRINTS', '500'))
+    config['SLOW_QUERY_EXPLAIN'] = os.environ.get('SLOW_QUERY_EXPLAIN', 'false').lower() == 'true'
+    
+    # Share of requests to trace (a caller's sampled traceparent is always
+    # followed) and the OTLP JSON lines file sampled traces are appended to
+    config['TRACE_SAMPLE_RATE'] = float(os.environ.get('TRACE_SAMPLE_RATE', '0'))
+    config['TRACE_FILE'] = os.environ.get('TRACE_FILE', 'traces.jsonl')
+    
+    # Admin endpoints (/admin/...) need "Authorization: Bearer <ADMIN_TOKEN>"
+    # and are hidden entirely when it is unset
+    config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN')
+    config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', 'profiles')
+    config['PROFILE_INTERVAL_MS'] = float(os.environ.get('PROFILE_INTERVAL_MS', '5'))
+    config['PROFILE_MAX_SECONDS'] = float(os.environ.get('PROFILE_MAX_SECONDS', '300'))
+    config['MEMORY_SNAPSHOTS'] = int(os.environ.get('MEMORY_SNAPSHOTS', '5'))
+    config['MEMORY_SAMPLE_INTERVAL'] = float(os.environ.get('MEMORY_SAMPLE_INTERVAL', '30'))
+    config['PASSWORD_STATS_INTERVAL'] = float(os.environ.get('PASSWORD_STATS_INTERVAL', '300'))
+    
+    config.update(overrides)
+    if not config['SQLALCHEMY_DATABASE_URI'] and config['EMBEDDED_DB']:
+        config['SQLALCHEMY_DATABASE_URI'] = embedded_database_url(config['EMBEDDED_DB'])
+    if not config['SQLALCHEMY_DATABASE_URI']:
+        raise ValueError("DATABASE_URL or EMBEDDED_DB environment variable is required")
+    config['SQLALCHEMY_DATABASE_URI'] = normalize_database_url(config['SQLALCHEMY_DATABASE_URI'])
+    # Expand short forms ('scrypt', 'pbkdf2:sha256') to the full method
+    # werkzeug writes into each hash, which is what stored hashes are
+    # compared against; an unknown method fails here rather than at login
+    config['PASSWORD_HASH_METHOD'] = hash_method(generate_password_hash('', method=config['PASSWORD_HASH_METHOD']))
+    if is_in_memory(config['SQLALCHEMY_DATABASE_URI']):
+        # A private in-memory database per connection would look empty to the pool
+        config['SQLALCHEMY_DATABASE_URI'] = MEMORY_DATABASE_URL
+    config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(config))
+
+def create_app(config=None):
+    """Application factory.
+
+    Importing this module has no side effects. Building the app creates
+    engines but opens no connections, so a gunicorn master can preload it
+    and fork workers that each open their own pool.
+    """
+    app = Flask(__name__)
+    load_config(app.config, config or {})
+    print(f"✅ Using {make_url(app.config['SQLALCHEMY_DATABASE_URI']).get_backend_name()} database")
+    
+    # Create upload folder if it doesn't exist
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    
+    TimedQueuePool.warn_after = app.config['DB_POOL_WAIT_WARN_MS'] / 1000
+    homepage_cache.ttl = app.config['HOMEPAGE_CACHE_TTL']
+    search_cache.ttl = app.config['SEARCH_CACHE_TTL']
+    search_cache.max_entries = app.config['SEARCH_CACHE_SIZE']
+    slow_query_log.threshold = app.config['SLOW_QUERY_MS'] / 1000
+    slow_query_log.max_entries = app.config['SLOW_QUERY_MAX_FINGERPRINTS']
+    slow_query_log.explain = app.config['SLOW_QUERY_EXPLAIN']
+    replica_router.keys = [key for key in app.config['SQLALCHEMY_BINDS'] if key.startswith('replica')]
+    
+    db.init_app(app)
+    with app.app_context():
+        for key in replica_router.keys:
+            db.event.listen(db.engines[key], 'handle_error', functools.partial(replica_failed, key))
+        for key, engine in db.engines.items():
+            if isinstance(engine.pool, TimedQueuePool):
+                engine.pool.database = key or 'default'
+            if engine.dialect.name == 'sqlite':
+                db.event.listen(engine, 'connect', configure_sqlite_connection)
+            db.event.listen(engine, 'before_cursor_execute', statement_started)
+            db.event.listen(engine, 'after_cursor_execute', statement_finished)
+            db.event.listen(engine, 'handle_error', statement_failed)
+    before_render_template.connect(start_template_span, app)
+    template_rendered.connect(end_template_span, app)
+    
+    app.register_blueprint(bp)
+    
+    # An in-memory database starts empty in every process. The anchor holds
+    # it open while pooled connections are recycled or disposed after fork.
+    if is_in_memory(app.config['SQLALCHEMY_DATABASE_URI']):
+        app.extensions['memory_database_anchor'] = sqlite3.connect(MEMORY_DATABASE, uri=True, check_same_thread=False)
+        with app.app_context():
+            init_database()
+    return app
+
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers proceed during a write; wait for locks instead of failing
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA busy_timeout=5000')
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records checkout wait time, including connecting, in
+    the rentit_db_pool_wait_seconds histogram and reports its usage to the
+    metrics"""
+    warn_after = 0.1
+    # Bind key in the metrics; kept when the pool is recreated on dispose()
+    database = 'default'
+    
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            metrics.DB_POOL_WAIT.observe(waited)
+            self.report_usage()
+            if waited > self.warn_after:
+                print(f"⚠️ Waited {waited * 1000:.0f} ms for a database connection ({self.status()})")
+    
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        self.report_usage()
+    
+    def recreate(self):
+        pool = super().recreate()
+        pool.database = self.database
+        return pool
+    
+    def report_usage(self):
+        metrics.DB_POOL_CHECKED_OUT.labels(self.database).set(self.checkedout())
+        metrics.DB_POOL_OVERFLOW.labels(self.database).set(max(0, self.overflow()))
+
+def engine_options(config):
+    url = config['SQLALCHEMY_DATABASE_URI']
+    if is_in_memory(url):
+        # Shared-cache connections lock whole tables and fail rather than wait
+        # on each other, so requests take turns with a single connection
+        return {
+            'poolclass': TimedQueuePool,
+            'pool_size': 1,
+            'max_overflow': 0,
+            'pool_timeout': config['DB_POOL_TIMEOUT'],
+            'connect_args': {'check_same_thread': False},
+        }
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+    }
+    if config['DB_STATEMENT_TIMEOUT_MS'] and make_url(url).get_backend_name() == 'postgresql':
+        options['connect_args'] = {'options': f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT_MS']}"}
+    return options
+
+class ReplicaRouter:
+    """Round-robin over the replicas that last passed a health check"""
+    def __init__(self, keys=()):
+        self.keys = list(keys)
+        self._down = set()
+        self._counter = itertools.count()
+    
+    def choose(self):
+        for _ in range(len(self.keys)):
+            key = self.keys[next(self._counter) % len(self.keys)]
+            if key not in self._down:
+                return key
+        return None
+    
+    def mark_down(self, key):
+        self._down.add(key)
+    
+    def mark_up(self, key):
+        self._down.discard(key)
+
+replica_router = ReplicaRouter()
+
+class RoutingSession(Session):
+    """Sends queries to the replica picked for this request, if any.
+
+    Flushes always use the primary, and models have no bind key, so anything
+    outside a @read_only view keeps using the primary.
+    """
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_request_context() and g.get('replica_key'):
+            return self._db.engines[g.replica_key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
-# Create upload folder if it doesn't exist
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+def read_only(view):
+    """Serve a pure-read view from a replica, unless the visitor wrote
+    recently and must see their own changes"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if replica_router.keys and session.get('primary_until', 0) < time.time():
+            g.replica_key = replica_router.choose()
+        return view(*args, **kwargs)
+    return wrapper
 
-db = SQLAlchemy(app)
+@contextlib.contextmanager
+def primary_reads():
+    """Read from the primary inside a @read_only view, e.g. to fill a cache
+    shared with visitors who have just written"""
+    replica_key = g.pop('replica_key', None) if has_request_context() else None
+    try:
+        yield
+    finally:
+        if replica_key is not None:
+            g.replica_key = replica_key
+
+@db.event.listens_for(RoutingSession, 'after_flush')
+def remember_write(db_session, flush_context):
+    if has_request_context():
+        g.wrote = True
+
+@bp.after_app_request
+def stick_to_primary_after_write(response):
+    # Replicas lag a little; keep this visitor's reads on the primary for a while
+    if replica_router.keys and g.get('wrote'):
+        session['primary_until'] = time.time() + current_app.config['REPLICA_STICKY_SECONDS']
+    return response
+
+def replica_failed(key, context):
+    if context.is_disconnect:
+        replica_router.mark_down(key)
+
+# Tracing
+@bp.before_app_request
+def start_request_trace():
+    route = str(request.url_rule or request.path)
+    tracing.start_trace(f'{request.method} {route}', current_app.config['TRACE_SAMPLE_RATE'],
+                        request.headers.get('traceparent'),
+                        {'http.request.method': request.method, 'http.route': route, 'url.path': request.path})
+
+@bp.after_app_request
+def add_trace_header(response):
+    trace = tracing.current_trace()
+    if trace is not None:
+        response.headers['X-Trace-Id'] = trace.trace_id
+        if trace.root is not None:
+            trace.root.attributes['http.response.status_code'] = response.status_code
+    return response
+
+@bp.teardown_app_request
+def finish_request_trace(error):
+    tracing.finish_trace(error)
+
+def start_template_span(sender, template, context, **extra):
+    g.setdefault('template_spans', []).append(tracing.start_span('render_template', {'template': template.name}))
+
+def end_template_span(sender, template, context, **extra):
+    tracing.end_span(g.template_spans.pop())
+
+def export_traces(app):
+    """Append sampled traces to TRACE_FILE; runs in a daemon thread"""
+    tracing.write_traces(app.config['TRACE_FILE'])
+
+# Per-request SQL statistics
+class QueryBudgetExceeded(Exception):
+    """A request ran more than QUERY_BUDGET statements, or one statement
+    shape more than QUERY_REPEAT_LIMIT times (usually an N+1 loop)"""
+
+def statement_shape(statement):
+    """A statement with whitespace collapsed and IN lists folded, so that
+    repeats of one query compare equal"""
+    statement = re.sub(r'\s+', ' ', statement).strip()
+    return re.sub(r'\bIN \([^()]*\)', 'IN (...)', statement, flags=re.IGNORECASE)
+
+def statement_started(conn, cursor, statement, parameters, context, executemany):
+    context.started_at = time.perf_counter()
+    context.trace_span = tracing.start_span('db.statement', {'db.system': conn.dialect.name, 'db.statement': statement[:1000]},
+                                            tracing.CLIENT)
+
+def statement_failed(context):
+    if context.execution_context is not None:
+        tracing.end_span(getattr(context.execution_context, 'trace_span', None), context.original_exception)
+
+def statement_finished(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - context.started_at
+    tracing.end_span(context.trace_span)
+    metrics.QUERY_DURATION.observe(seconds)
+    if slow_query_log.threshold and seconds >= slow_query_log.threshold and not statement.startswith('EXPLAIN'):
+        record_slow_query(conn, statement, parameters, seconds, executemany)
+    # Background threads (derivatives, health checks) have no request
+    if not has_request_context():
+        return
+    stats = g.setdefault('query_stats', {'count': 0, 'seconds': 0.0, 'shapes': Counter()})
+    stats['count'] += 1
+    stats['seconds'] += seconds
+    stats['shapes'][statement_shape(statement)] += 1
+
+# Slow statements of this worker, by fingerprint
+slow_query_log = slow_queries.SlowQueryLog()
+_explain_pool = None
+_explain_pool_pid = None
+
+def explain_pool():
+    """Per-process single thread that EXPLAINs slow statements, created
+    after any fork"""
+    global _explain_pool, _explain_pool_pid
+    if _explain_pool_pid != os.getpid():
+        _explain_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='explain')
+        _explain_pool_pid = os.getpid()
+    return _explain_pool
+
+def explain_slow_query(engine, key, statement, parameters):
+    prefix = 'EXPLAIN ' if engine.dialect.name == 'postgresql' else 'EXPLAIN QUERY PLAN '
+    try:
+        with engine.connect() as connection:
+            plan = [row[-1] for row in connection.exec_driver_sql(prefix + statement, parameters)]
+    except Exception as e:
+        plan = [f'EXPLAIN failed: {e}']
+    slow_query_log.set_plan(key, plan)
+
+def record_slow_query(conn, statement, parameters, seconds, executemany):
+    endpoint = (request.endpoint or 'none') if has_request_context() else threading.current_thread().name
+    key = slow_queries.fingerprint(statement)
+    metrics.SLOW_QUERIES.labels(endpoint).inc()
+    print(f"🐢 {seconds * 1000:.0f} ms on {endpoint}: {key[:200]}")
+    wants_plan = slow_query_log.record(key, seconds, endpoint, parameters, executemany)
+    # Only plain reads are safe to re-plan
+    if wants_plan and re.match(r'\s*(SELECT|WITH)\b', statement, re.IGNORECASE):
+        if isinstance(parameters, dict):
+            parameters = dict(parameters)
+        explain_pool().submit(explain_slow_query, conn.engine, key, statement, parameters)
+
+def query_budget_problems(stats):
+    problems = []
+    budget = current_app.config['QUERY_BUDGET']
+    if budget and stats['count'] > budget:
+        problems.append(f"{stats['count']} queries, budget is {budget}")
+    limit = current_app.config['QUERY_REPEAT_LIMIT']
+    for shape, count in stats['shapes'].items():
+        if limit and count > limit:
+            problems.append(f"repeated {count} times: {shape[:200]}")
+    return problems
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.in_flight = True
+    metrics.REQUESTS_IN_PROGRESS.inc()
+
+@bp.teardown_app_request
+def finish_request(error):
+    if g.pop('in_flight', False):
+        metrics.REQUESTS_IN_PROGRESS.dec()
+
+@bp.after_app_request
+def report_query_stats(response):
+    stats = g.get('query_stats', {'count': 0, 'seconds': 0.0, 'shapes': Counter()})
+    total = time.perf_counter() - g.get('request_started', time.perf_counter())
+    response.headers.add('Server-Timing', f'db;dur={stats["seconds"] * 1000:.1f};desc="{stats["count"]} queries"')
+    response.headers.add('Server-Timing', f'app;dur={total * 1000:.1f}')
+    metrics.REQUEST_LATENCY.labels(request.endpoint or 'none', request.method, response.status_code).observe(total)
+    if current_app.config['QUERY_LOG']:
+        print(f"🗄️ {request.method} {request.path}: {stats['count']} queries, "
+              f"{stats['seconds'] * 1000:.1f} of {total * 1000:.1f} ms in the database")
+    
+    problems = query_budget_problems(stats)
+    if problems:
+        strict = current_app.config['QUERY_BUDGET_STRICT']
+        if strict is None:
+            strict = current_app.debug or current_app.testing
+        if strict:
+            raise QueryBudgetExceeded(f"{request.endpoint}: {'; '.join(problems)}")
+        for problem in problems:
+            print(f"⚠️ Query budget exceeded on {request.endpoint}: {problem}")
+    return response
+
+def warm_up_pool(app):
+    """Open the pool's base connections before serving traffic, so the first
+    requests after a (re)start don't pay connection setup"""
+    with app.app_context():
+        size = db.engine.pool.size() if isinstance(db.engine.pool, QueuePool) else 1
+        connections = []
+        try:
+            for _ in range(size):
+                connection = db.engine.connect()
+                connection.execute(db.text('SELECT 1'))
+                connections.append(connection)
+            print(f"✅ Warmed up {len(connections)} database connections")
+        except Exception as e:
+            print(f"⚠️ Database warm-up failed: {e}")
+        finally:
+            for connection in connections:
+                connection.close()
 
 # Database Models
+# Bump whenever init_database() gains a step, so workers can tell the
+# database has not been migrated for this code yet
+SCHEMA_VERSION = 1
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -45,6 +518,18 @@ class User(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     listings = db.relationship('Listing', backref='owner', lazy=True)
 
+class SchemaVersion(db.Model):
+    """Single row recording the schema version `flask init-db` last applied"""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class UploadBlob(db.Model):
+    """A content-addressed upload shared by every listing that uses it"""
+    key = db.Column(db.String(100), primary_key=True)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class Listing(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -53,86 +538,875 @@ class Listing(db.Model):
     rental_period = db.Column(db.String(20), nullable=False)
     category = db.Column(db.String(50), nullable=False)
     location = db.Column(db.String(100), nullable=False, default='Gadhinglaj')
-    images = db.Column(db.Text)
+    images = db.Column(db.Text)  # Legacy JSON list, moved to ListingImage by `flask init-db`
+    cover_image = db.Column(db.String(120))  # Upload path of the card image
     contact_number = db.Column(db.String(15), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_featured = db.Column(db.Boolean, default=False)
+    photos = db.relationship('ListingImage', backref='listing', lazy=True,
+                             order_by='ListingImage.position', cascade='all, delete-orphan')
+
+    __table_args__ = (
+        # Recent listings and keyset pagination order for search results
+        db.Index('ix_listing_created_at_id', 'created_at', 'id'),
+        # Featured listings on the homepage
+        db.Index('ix_listing_featured_created_at', 'created_at',
+                 postgresql_where=is_featured == db.true(),
+                 sqlite_where=is_featured == db.true()),
+        # My ads
+        db.Index('ix_listing_user_created_at', 'user_id', 'created_at'),
+        # Search filtered by location and/or category
+        db.Index('ix_listing_location_created_at_id', 'location', 'created_at', 'id'),
+        db.Index('ix_listing_location_category_created_at_id', 'location', 'category', 'created_at', 'id'),
+        db.Index('ix_listing_category_created_at_id', 'category', 'created_at', 'id'),
+    )
+
+class ListingImage(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    listing_id = db.Column(db.Integer, db.ForeignKey('listing.id', ondelete='CASCADE'), nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    blob_key = db.Column(db.String(100), nullable=False)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    # JSON {variant: {width, height, <ext>: upload path}}, set once derivatives exist
+    variants = db.Column(db.Text)
+
+    __table_args__ = (
+        db.Index('ix_listing_image_listing_position', 'listing_id', 'position', unique=True),
+        db.Index('ix_listing_image_blob_key', 'blob_key'),
+    )
+
+# Full-text search (PostgreSQL only). The tsvector column is generated by the
+# database, so it stays in sync with title/description without app code.
+SEARCH_TEXT_CONFIG = 'english'
+SEARCH_SCHEMA_DDL = [
+    f"""ALTER TABLE listing ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('{SEARCH_TEXT_CONFIG}', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('{SEARCH_TEXT_CONFIG}', coalesce(description, '')), 'B')
+        ) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_listing_search_vector ON listing USING GIN (search_vector)",
+]
+# Trigram index for typo-tolerant title matching; needs the pg_trgm extension,
+# which managed databases may not let us create.
+TRIGRAM_SCHEMA_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_listing_title_trgm ON listing USING GIN (title gin_trgm_ops)",
+]
+listing_search_vector = db.literal_column('listing.search_vector')
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Uploads
+UPLOAD_CHUNK_SIZE = 64 * 1024
+_image_pool = None
+_image_pool_pid = None
+_image_pool_lock = threading.Lock()
+
+def image_pool():
+    """Per-process pool for CPU-heavy image work, created after any fork"""
+    global _image_pool, _image_pool_pid
+    with _image_pool_lock:
+        if _image_pool_pid != os.getpid():
+            # Spawned workers only import the small imaging module, not this app
+            _image_pool = ProcessPoolExecutor(max_workers=current_app.config['IMAGE_WORKERS'],
+                                              mp_context=multiprocessing.get_context('spawn'))
+            _image_pool_pid = os.getpid()
+        return _image_pool
+
+def submit_image_job(fn, *args):
+    """Submit to the image pool, replacing it first if one of its processes
+    died (e.g. killed for memory), which leaves the pool unusable"""
+    global _image_pool_pid
+    pool = image_pool()
+    try:
+        return pool.submit(fn, *args)
+    except BrokenProcessPool:
+        with _image_pool_lock:
+            if _image_pool is pool and _image_pool_pid == os.getpid():
+                print("⚠️ Image pool broken; starting a new one")
+                pool.shutdown(wait=False)
+                _image_pool_pid = None
+        return image_pool().submit(fn, *args)
+
+# Password hashing
+_hash_pool = None
+_hash_pool_pid = None
+_hash_slots = None
+_hash_pool_lock = threading.Lock()
+
+def hash_pool():
+    """Per-process pool for password hashing, created after any fork"""
+    global _hash_pool, _hash_pool_pid, _hash_slots
+    with _hash_pool_lock:
+        if _hash_pool_pid != os.getpid():
+            # Separate processes so hashing neither holds the GIL nor queues
+            # behind image work
+            _hash_pool = ProcessPoolExecutor(max_workers=current_app.config['HASH_WORKERS'],
+                                             mp_context=multiprocessing.get_context('spawn'))
+            _hash_slots = threading.BoundedSemaphore(current_app.config['HASH_QUEUE_DEPTH'])
+            _hash_pool_pid = os.getpid()
+        return _hash_pool, _hash_slots
+
+def discard_hash_pool(pool):
+    """Replace the hash pool on next use after one of its processes died
+    (e.g. killed for memory), which leaves the pool unusable. Requests
+    that were waiting on it get 503, not a login error."""
+    global _hash_pool_pid
+    with _hash_pool_lock:
+        if _hash_pool is pool and _hash_pool_pid == os.getpid():
+            print("⚠️ Hash pool broken; starting a new one")
+            pool.shutdown(wait=False)
+            _hash_pool_pid = None
+
+def run_hashing(fn, *args):
+    """Run a passwords function in the pool, or fail fast with 503 when this
+    worker already has HASH_QUEUE_DEPTH hashes in flight or the hash takes
+    longer than HASH_TIMEOUT"""
+    pool, slots = hash_pool()
+    if not slots.acquire(blocking=False):
+        abort(503)
+    with tracing.span(f'password.{fn.__name__}'):
+        try:
+            future = pool.submit(fn, *args)
+        except BrokenProcessPool:
+            slots.release()
+            discard_hash_pool(pool)
+            abort(503)
+        except BaseException:
+            slots.release()
+            raise
+        # The slot is freed when the job ends, not when we stop waiting, so
+        # hashes that timed out still count against the queue depth
+        future.add_done_callback(lambda future: slots.release())
+        try:
+            return future.result(timeout=current_app.config['HASH_TIMEOUT'])
+        except TimeoutError:
+            # Drops the job if it hasn't started; a running one keeps its slot
+            future.cancel()
+            abort(503)
+        except BrokenProcessPool:
+            discard_hash_pool(pool)
+            abort(503)
+
+def hash_password(password):
+    return run_hashing(passwords.hash_password, password, current_app.config['PASSWORD_HASH_METHOD'])
+
+def verify_password(pwhash, password):
+    return run_hashing(passwords.verify_password, pwhash, password)
+
+def hash_method(pwhash):
+    """The werkzeug method string a hash was made with, e.g. 'scrypt:32768:8:1'"""
+    return pwhash.split('$', 1)[0]
+
+def upgrade_password_hash(user, password):
+    """Rehash a just-verified password made with an outdated method/cost"""
+    old_method = hash_method(user.password)
+    if old_method == current_app.config['PASSWORD_HASH_METHOD']:
+        return
+    try:
+        user.password = hash_password(password)
+        db.session.commit()
+        metrics.PASSWORD_HASH_UPGRADES.inc()
+        print(f"🔐 Upgraded password hash for user {user.id} from {old_method}")
+    except Exception as e:
+        # The login itself succeeded; try again next time
+        db.session.rollback()
+        print(f"⚠️ Password hash upgrade failed for user {user.id}: {e}")
+
+def legacy_password_hash_count():
+    """Users whose hash does not use PASSWORD_HASH_METHOD"""
+    return User.query.filter(
+        ~User.password.startswith(current_app.config['PASSWORD_HASH_METHOD'] + '$', autoescape=True)
+    ).count()
+
+def read_manifest(key):
+    try:
+        with open(imaging.manifest_path(os.path.join(current_app.config['UPLOAD_FOLDER'], key))) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def variant_paths(key, manifest):
+    """Variant name -> dimensions and upload path per format"""
+    return {
+        variant: dict(size, **{ext: imaging.derivative_path(key, variant, ext) for ext in imaging.FORMATS})
+        for variant, size in manifest['variants'].items()
+    }
+
+def apply_manifest(key, manifest):
+    """Record derivative sizes/paths on every image using the blob and
+    switch listing covers to its thumbnail"""
+    ListingImage.query.filter_by(blob_key=key).update({
+        'width': manifest['width'],
+        'height': manifest['height'],
+        'variants': json.dumps(variant_paths(key, manifest)),
+    })
+    Listing.query.filter_by(cover_image=key).update({
+        'cover_image': imaging.derivative_path(key, 'thumb', 'webp'),
+    })
+    db.session.commit()
+
+# Derivative jobs of this process by blob key, until their manifest is on disk
+_derivative_jobs = {}
+_derivative_jobs_lock = threading.Lock()
+
+def derivatives_done(key, future):
+    with _derivative_jobs_lock:
+        _derivative_jobs.pop(key, None)
+
+def derivatives_ready(app, key, future):
+    try:
+        manifest = future.result()
+        metrics.IMAGE_PROCESSING.observe(manifest['seconds'])
+        with app.app_context():
+            apply_manifest(key, manifest)
+        print(f"🖼️ Derivatives for {key} ready in {manifest['seconds']}s")
+    except Exception as e:
+        print(f"❌ Derivatives failed for {key}: {e}")
+
+def derivatives_shared(app, key, future):
+    """Apply a job queued for another upload of the same blob"""
+    try:
+        with app.app_context():
+            apply_manifest(key, future.result())
+    except Exception as e:
+        print(f"❌ Derivatives failed for {key}: {e}")
+
+def queue_derivatives(keys):
+    """Generate derivatives for committed images, or apply existing ones.
+
+    A blob whose job is already running is not queued again; the images
+    just committed get that job's result when it finishes.
+    """
+    app = current_app._get_current_object()
+    for key in keys:
+        image_path = os.path.join(current_app.config['UPLOAD_FOLDER'], key)
+        with _derivative_jobs_lock:
+            future = _derivative_jobs.get(key)
+            # A job writes its manifest before it finishes, so once it has
+            # left _derivative_jobs the manifest is on disk
+            manifest = read_manifest(key) if future is None else None
+            queued = future is None and manifest is None
+            if queued:
+                future = _derivative_jobs[key] = submit_image_job(imaging.generate_derivatives, image_path)
+        # Callbacks of a finished future run at once, so add them unlocked
+        if queued:
+            future.add_done_callback(functools.partial(derivatives_done, key))
+            future.add_done_callback(functools.partial(derivatives_ready, app, key))
+        elif future is not None:
+            future.add_done_callback(functools.partial(derivatives_shared, app, key))
+        else:
+            apply_manifest(key, manifest)
+
+def attach_images(listing, keys, position=0):
+    """Add image rows for a flushed listing, starting at the given position"""
+    rows = []
+    for offset, key in enumerate(keys):
+        manifest = read_manifest(key)
+        rows.append({
+            'listing_id': listing.id,
+            'position': position + offset,
+            'blob_key': key,
+            'width': manifest and manifest['width'],
+            'height': manifest and manifest['height'],
+            'variants': manifest and json.dumps(variant_paths(key, manifest)),
+        })
+    if rows:
+        # One executemany rather than an INSERT per image
+        db.session.execute(db.insert(ListingImage), rows)
+    if keys and not listing.cover_image:
+        listing.cover_image = keys[0]
+        if read_manifest(keys[0]) is not None:
+            listing.cover_image = imaging.derivative_path(keys[0], 'thumb', 'webp')
+
+@tracing.traced('upload.save')
+def save_upload(image):
+    """Store an uploaded image under its content hash. Returns the blob key,
+    e.g. 'ab/cd/<sha256>.jpg'.
+
+    Identical files share one blob; callers record references with
+    acquire_blobs() in the same transaction as the listing and call
+    settle_uploads() and then queue_derivatives() once it has committed.
+    During a request the file is only put in place by settle_uploads(), so a
+    blob being deleted concurrently can't take the new upload with it.
+    """
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    ext = image.filename.rsplit('.', 1)[1].lower().replace('jpeg', 'jpg')
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=upload_folder, suffix='.part')
+    try:
+        # Hash while writing so the upload is read only once
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in iter(lambda: image.stream.read(UPLOAD_CHUNK_SIZE), b''):
+                digest.update(chunk)
+                f.write(chunk)
+            metrics.UPLOAD_BYTES.observe(f.tell())
+        sha = digest.hexdigest()
+        key = f'{sha[:2]}/{sha[2:4]}/{sha}.{ext}'
+        image_path = os.path.join(upload_folder, key)
+        pending = g.setdefault('pending_uploads', {}) if has_request_context() else None
+        if pending is not None and key not in pending:
+            pending[key] = tmp_path
+        elif pending is not None or os.path.exists(image_path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(image_path), exist_ok=True)
+            os.replace(tmp_path, image_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return key
+
+@contextlib.contextmanager
+def blob_lock(key):
+    """Exclusive lock, across processes, on deciding whether a blob's files
+    stay; one lock file per leading pair of hash digits"""
+    lock_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], '.locks')
+    os.makedirs(lock_dir, exist_ok=True)
+    with open(os.path.join(lock_dir, key[:2]), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def settle_uploads():
+    """Put this request's uploads in place once their references have
+    committed, restoring any blob a concurrent delete has just removed"""
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    for key, tmp_path in g.pop('pending_uploads', {}).items():
+        image_path = os.path.join(upload_folder, key)
+        with blob_lock(key):
+            if os.path.exists(image_path):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(image_path), exist_ok=True)
+                os.replace(tmp_path, image_path)
+
+@bp.teardown_app_request
+def discard_pending_uploads(error):
+    """Drop uploads whose listing was never committed"""
+    for tmp_path in g.pop('pending_uploads', {}).values():
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def acquire_blobs(keys, references=1):
+    """Add references per occurrence of a key (one by default), creating
+    blob rows as needed, in a single statement"""
+    counts = Counter(keys)
+    if not counts:
+        return
+    insert = (postgresql_insert if is_postgres() else sqlite_insert)(UploadBlob)
+    db.session.execute(
+        insert.values([{'key': key, 'ref_count': count * references} for key, count in counts.items()])
+        .on_conflict_do_update(
+            index_elements=[UploadBlob.key],
+            set_={'ref_count': UploadBlob.ref_count + insert.excluded.ref_count}
+        )
+    )
+
+def release_blobs(keys):
+    """Drop one reference per key. Returns the keys that are no longer
+    referenced; delete their files with remove_upload() after committing."""
+    unreferenced = []
+    counts = Counter(keys)
+    if not counts:
+        return unreferenced
+    blobs = {blob.key: blob for blob in
+             UploadBlob.query.filter(UploadBlob.key.in_(counts)).with_for_update()}
+    for key, count in counts.items():
+        blob = blobs.get(key)
+        if blob is None:
+            # Uploaded before content addressing; never shared
+            unreferenced.append(key)
+            continue
+        blob.ref_count -= count
+        if blob.ref_count <= 0:
+            db.session.delete(blob)
+            unreferenced.append(key)
+    return unreferenced
+
+def remove_upload(key):
+    """Delete a released blob's files, unless an upload has referenced it
+    again since the release committed"""
+    image_path = os.path.join(current_app.config['UPLOAD_FOLDER'], key)
+    with blob_lock(key):
+        # Under the lock, either the new reference is visible here or the
+        # upload's settle_uploads() runs after us and restores the file
+        if UploadBlob.query.filter_by(key=key).first() is not None:
+            return
+        # The original goes last: its absence means the derivatives are gone too
+        for path in imaging.derivative_files(image_path) + [image_path]:
+            if os.path.exists(path):
+                os.remove(path)
+
+def after_commit(step, *args):
+    """Run follow-up work for a write that has committed. The write stands
+    whatever happens here, so a failure is logged rather than reported to
+    the user, who would otherwise retry and duplicate it."""
+    try:
+        step(*args)
+    except Exception as e:
+        db.session.rollback()
+        print(f"⚠️ {step.__name__} failed after commit: {e}")
+
+def is_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+def ensure_search_schema():
+    """Create the full-text search column and index on PostgreSQL"""
+    if not is_postgres():
+        return
+    for statement in SEARCH_SCHEMA_DDL:
+        db.session.execute(db.text(statement))
+    db.session.commit()
+    try:
+        for statement in TRIGRAM_SCHEMA_DDL:
+            db.session.execute(db.text(statement))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"⚠️ Trigram search unavailable: {e}")
+
+_trigram_available = None
+
+def has_trigram():
+    """Whether pg_trgm is installed; checked once per process"""
+    global _trigram_available
+    if _trigram_available is None:
+        _trigram_available = is_postgres() and db.session.execute(
+            db.text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        ).first() is not None
+    return _trigram_available
+
+def text_search(listings_query, query):
+    """Filter listings by a free-text query.
+
+    Returns the filtered query and its sort keys (all descending), most
+    significant first, ending with the (created_at, id) keyset.
+    """
+    sort_keys = [Listing.created_at, Listing.id]
+    if query and is_postgres():
+        ts_query = db.func.websearch_to_tsquery(SEARCH_TEXT_CONFIG, query)
+        listings_query = listings_query.filter(listing_search_vector.op('@@')(ts_query))
+        # Ranks are real (float4); as double precision the value a cursor
+        # stores round-trips exactly, so rows tied on rank are neither
+        # repeated nor skipped at page boundaries
+        sort_keys.insert(0, db.cast(db.func.ts_rank(listing_search_vector, ts_query), db.Double))
+    elif query:
+        # Fallback for non-PostgreSQL databases (e.g. local SQLite)
+        listings_query = listings_query.filter(
+            db.or_(
+                Listing.title.ilike(f'%{query}%'),
+                Listing.description.ilike(f'%{query}%')
+            )
+        )
+    return listings_query, sort_keys
+
+def fuzzy_title_search(listings_query, query):
+    """Match titles containing a word similar to the query (PostgreSQL + pg_trgm)"""
+    # The <% operator is served by the trigram GIN index; its cut-off is the
+    # transaction-local word_similarity_threshold setting.
+    db.session.execute(
+        db.text("SELECT set_config('pg_trgm.word_similarity_threshold', :threshold, true)"),
+        {'threshold': str(current_app.config['SEARCH_SIMILARITY_THRESHOLD'])}
+    )
+    listings_query = listings_query.filter(db.literal(query).op('<%')(Listing.title))
+    similarity = db.cast(db.func.word_similarity(query, Listing.title), db.Double)
+    return listings_query, [similarity, Listing.created_at, Listing.id]
+
+def cursor_serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='search-cursor')
+
+def encode_cursor(scope, values):
+    """Sign the sort-key values of the last row on a page"""
+    *ranks, created_at, listing_id = values
+    return cursor_serializer().dumps([scope, ranks, created_at.isoformat(), listing_id])
+
+def decode_cursor(token, scope):
+    """Return the sort-key values for a cursor, or None if it is invalid or
+    was issued for a different search"""
+    try:
+        token_scope, ranks, created_at, listing_id = cursor_serializer().loads(token)
+        if token_scope != scope:
+            return None
+        return [*ranks, datetime.fromisoformat(created_at), int(listing_id)]
+    except (BadSignature, TypeError, ValueError):
+        return None
+
+def keyset_query(listings_query, sort_keys, after, page_size):
+    """Order by sort_keys (descending) and limit to one page plus one row,
+    starting after the given key values"""
+    if after is not None:
+        listings_query = listings_query.filter(db.tuple_(*sort_keys) < db.tuple_(*after))
+    return (listings_query.add_columns(*sort_keys)
+            .order_by(*[key.desc() for key in sort_keys])
+            .limit(page_size + 1))
+
+def keyset_page(listings_query, sort_keys, after, page_size):
+    """Fetch one page. Returns the listings and the last row's key values if
+    there is a next page."""
+    rows = keyset_query(listings_query, sort_keys, after, page_size).all()
+    listings = [row[0] for row in rows[:page_size]]
+    next_values = list(rows[page_size - 1][1:]) if len(rows) > page_size else None
+    return listings, next_values
+
+def capped_count(listings_query, cap):
+    """Count matching rows, stopping after cap + 1"""
+    limited = listings_query.order_by(None).with_entities(Listing.id).limit(cap + 1).subquery()
+    return db.session.query(db.func.count()).select_from(limited).scalar()
+
+# Queries behind the hot routes, shared with the query plan check
+def featured_listings_query():
+    return Listing.query.filter(Listing.is_featured == db.true()).order_by(Listing.created_at.desc()).limit(2)
+
+def recent_listings_query():
+    return Listing.query.order_by(Listing.created_at.desc()).limit(8)
+
+def user_listings_query(user_id):
+    return Listing.query.filter_by(user_id=user_id).order_by(Listing.created_at.desc())
+
+def search_base_query(location, category):
+    listings_query = Listing.query
+    if location and location != 'all':
+        listings_query = listings_query.filter(Listing.location == location)
+    if category and category != 'all':
+        listings_query = listings_query.filter(Listing.category == category)
+    return listings_query
+
+# Caching
+class LRUCache:
+    """Thread-safe in-process cache of at most max_entries entries, dropping
+    the least recently used first, whose entries expire after ttl seconds.
+
+    get_or_load() is single-flight: concurrent misses on one key wait for
+    the first caller's load instead of each running it.
+    """
+    def __init__(self, ttl, name, max_entries):
+        self.ttl = ttl
+        self.name = name
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._loading = {}
+        # Bumped by every eviction, so a load that raced one isn't stored
+        self._generation = 0
+        self._lock = threading.Lock()
+    
+    def get_or_load(self, key, load):
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] >= time.monotonic():
+                    self._entries.move_to_end(key)
+                    metrics.CACHE_REQUESTS.labels(self.name, 'hit').inc()
+                    return entry[1]
+                self._entries.pop(key, None)
+                loaded = self._loading.get(key)
+                if loaded is None:
+                    loaded = self._loading[key] = threading.Event()
+                    generation = self._generation
+                    break
+            # Another thread is loading this key; use its result, or take
+            # over if it failed
+            loaded.wait()
+        metrics.CACHE_REQUESTS.labels(self.name, 'miss').inc()
+        try:
+            value = load()
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[key] = (time.monotonic() + self.ttl, value)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            return value
+        finally:
+            with self._lock:
+                del self._loading[key]
+            loaded.set()
+    
+    def evict(self, predicate):
+        """Drop every entry whose key matches predicate"""
+        with self._lock:
+            self._generation += 1
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+    
+    def clear(self):
+        self.evict(lambda key: True)
+
+# Channel used to broadcast listing writes to every worker
+CACHE_CHANNEL = 'rentit_cache'
+
+# Homepage snapshot: rendered HTML for anonymous visitors and detached
+# listing rows for logged-in ones (whose navbar differs)
+homepage_cache = LRUCache(60, 'homepage', 2)
+
+def listing_snapshot(listing):
+    """Plain copy of a listing's columns, safe to share between requests"""
+    return SimpleNamespace(**{column.key: getattr(listing, column.key) for column in Listing.__table__.columns})
+
+def homepage_listings():
+    def load():
+        # A write evicts at once, so a lagging replica would cache the old
+        # homepage for the whole TTL
+        with primary_reads():
+            return (
+                [listing_snapshot(listing) for listing in featured_listings_query()],
+                [listing_snapshot(listing) for listing in recent_listings_query()],
+            )
+    return homepage_cache.get_or_load('listings', load)
+
+# First page of search results by (q, location, category): listing ids in
+# page order with the count, suggestion and next-page cursor
+search_cache = LRUCache(30, 'search', 1000)
+
+def normalize_search_text(value):
+    return ' '.join(value.split()).lower()
+
+def listings_by_id(ids):
+    """Listings in the order of ids, skipping any deleted since"""
+    if not ids:
+        return []
+    found = {listing.id: listing for listing in Listing.query.filter(Listing.id.in_(ids))}
+    return [found[listing_id] for listing_id in ids if listing_id in found]
+
+def listing_event(listing_id, categories, locations):
+    """Describe a listing write: the listing and every category/location whose
+    cached results it may change (both old and new values for edits)"""
+    return {'id': listing_id, 'categories': sorted(set(categories)), 'locations': sorted(set(locations))}
+
+def evict_listing_caches(event):
+    """Drop this worker's cached pages affected by a listing write"""
+    homepage_cache.clear()
+    # Searches without a location or category filter ('' or 'all') cover them all
+    categories = {normalize_search_text(category) for category in event['categories']} | {'', 'all'}
+    locations = {' '.join(location.split()) for location in event['locations']} | {'', 'all'}
+    search_cache.evict(lambda key: key[1] in locations and key[2] in categories)
+
+def invalidate_listing_caches(event):
+    """Evict caches locally, then tell every other worker via NOTIFY.
+
+    Called after the write has committed. Workers without a listener (SQLite,
+    lost connection) fall back to TTL expiry.
+    """
+    evict_listing_caches(event)
+    if not is_postgres():
+        return
+    try:
+        db.session.execute(db.text("SELECT pg_notify(:channel, :payload)"),
+                           {'channel': CACHE_CHANNEL, 'payload': json.dumps(event)})
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"⚠️ Cache invalidation notify failed: {e}")
+
+def listen_for_invalidations(app):
+    """Evict cache entries named by NOTIFY messages; runs in a daemon thread"""
+    with app.app_context():
+        if not is_postgres():
+            return
+        url = db.engine.url.set(drivername='postgresql').render_as_string(hide_password=False)
+    import psycopg
+    while True:
+        try:
+            with psycopg.connect(url, autocommit=True) as conn:
+                conn.execute(f'LISTEN {CACHE_CHANNEL}')
+                # Anything cached while we were not listening may be stale
+                homepage_cache.clear()
+                search_cache.clear()
+                for notify in conn.notifies():
+                    try:
+                        evict_listing_caches(json.loads(notify.payload))
+                    except ValueError:
+                        print(f"⚠️ Ignoring malformed cache invalidation: {notify.payload}")
+        except Exception as e:
+            print(f"⚠️ Cache invalidation listener disconnected, retrying: {e}")
+            time.sleep(5)
+
+def check_replicas(app):
+    """Ping every replica periodically, taking failed ones out of rotation"""
+    while replica_router.keys:
+        with app.app_context():
+            for key in replica_router.keys:
+                try:
+                    with db.engines[key].connect() as connection:
+                        connection.execute(db.text('SELECT 1'))
+                    replica_router.mark_up(key)
+                except Exception as e:
+                    replica_router.mark_down(key)
+                    print(f"⚠️ Replica {key} failed health check: {e}")
+        time.sleep(app.config['REPLICA_HEALTH_INTERVAL'])
+
+def sample_memory(app):
+    """Update the memory gauges periodically; runs in a daemon thread"""
+    while app.config['MEMORY_SAMPLE_INTERVAL'] > 0:
+        rss = memory.rss_bytes()
+        if rss is not None:
+            metrics.PROCESS_RSS.set(rss)
+        metrics.PYTHON_OBJECTS.set(memory.object_count())
+        metrics.TRACEMALLOC_TRACED.set(tracemalloc.get_traced_memory()[0])
+        time.sleep(app.config['MEMORY_SAMPLE_INTERVAL'])
+
+def count_legacy_password_hashes(app):
+    """Refresh the legacy hash gauge periodically rather than per scrape,
+    since the count scans the users table; runs in a daemon thread"""
+    while app.config['PASSWORD_STATS_INTERVAL'] > 0:
+        with app.app_context():
+            try:
+                metrics.PASSWORD_HASH_LEGACY.set(legacy_password_hash_count())
+            except Exception as e:
+                print(f"⚠️ Could not count legacy password hashes: {e}")
+        time.sleep(app.config['PASSWORD_STATS_INTERVAL'])
+
+# Daemon threads each worker process runs, started on its first request so
+# they are created after any fork
+background_tasks = [listen_for_invalidations, check_replicas, export_traces, sample_memory, count_legacy_password_hashes]
+_background_pid = None
+_background_lock = threading.Lock()
+
+@bp.before_app_request
+def start_background_tasks():
+    global _background_pid
+    if _background_pid == os.getpid():
+        return
+    with _background_lock:
+        if _background_pid == os.getpid():
+            return
+        _background_pid = os.getpid()
+        for task in background_tasks:
+            threading.Thread(target=task, args=(current_app._get_current_object(),),
+                             name=task.__name__, daemon=True).start()
+
+def ensure_indexes():
+    """Create model indexes missing from tables that already existed"""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+def ensure_columns():
+    """Add model columns missing from tables that already existed"""
+    inspector = db.inspect(db.engine)
+    quote = db.engine.dialect.identifier_preparer.quote
+    for table in db.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                db.session.execute(db.text(f'ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column_type}'))
+    db.session.commit()
+
+def migrate_listing_images(batch_size=500):
+    """Move legacy JSON image lists into listing_image rows"""
+    legacy = Listing.query.filter(Listing.images.isnot(None)).order_by(Listing.id)
+    migrated = 0
+    while True:
+        listings = legacy.limit(batch_size).all()
+        if not listings:
+            break
+        batch_keys = []
+        for listing in listings:
+            try:
+                keys = json.loads(listing.images) or []
+            except ValueError:
+                keys = []
+            attach_images(listing, keys)
+            listing.images = None
+            batch_keys.extend(keys)
+            migrated += 1
+        db.session.commit()
+        queue_derivatives(batch_keys)
+    if migrated:
+        print(f"✅ Migrated images for {migrated} listings")
+
 def init_database():
-    """Initialize database with retry logic"""
-    max_retries = 3
-    for attempt in range(max_retries):
+    """Create or migrate the schema and seed the demo user; run once per
+    deploy with `flask init-db`, not at worker start"""
+    db.create_all()
+    ensure_columns()
+    ensure_indexes()
+    ensure_search_schema()
+    migrate_listing_images()
+    # Create sample user if no users exist
+    if not User.query.first():
+        sample_user = User(
+            username='demo',
+            email='demo@example.com',
+            password=generate_password_hash('password', method=current_app.config['PASSWORD_HASH_METHOD']),
+            phone='1234567890'
+        )
+        db.session.add(sample_user)
+        print("✅ Database initialized with sample user")
+    version = db.session.get(SchemaVersion, 1) or SchemaVersion(id=1)
+    version.version = SCHEMA_VERSION
+    version.applied_at = datetime.utcnow()
+    db.session.add(version)
+    db.session.commit()
+    print(f"✅ Database schema at version {SCHEMA_VERSION}")
+
+def verify_schema(app):
+    """Cheap boot-time check that `flask init-db` has run for this code"""
+    with app.app_context():
         try:
-            with app.app_context():
-                db.create_all()
-                # Create sample user if no users exist
-                if not User.query.first():
-                    sample_user = User(
-                        username='demo',
-                        email='demo@example.com',
-                        password=generate_password_hash('password'),
-                        phone='1234567890'
-                    )
-                    db.session.add(sample_user)
-                    db.session.commit()
-                    print("✅ Database initialized with sample user")
-                else:
-                    print("✅ Database already initialized")
-                return True
+            version = db.session.get(SchemaVersion, 1)
         except Exception as e:
-            print(f"❌ Database initialization attempt {attempt + 1} failed: {e}")
-            if attempt < max_retries - 1:
-                time.sleep(2)  # Wait 2 seconds before retry
-            else:
-                print("❌ All database initialization attempts failed")
-                return False
+            db.session.rollback()
+            version = None
+            print(f"⚠️ Could not read schema version: {e}")
+        if version is None or version.version != SCHEMA_VERSION:
+            found = version.version if version else 'none'
+            print(f"❌ Database schema version {found}, expected {SCHEMA_VERSION}; run `flask init-db`")
+            return False
+        return True
 
-# Initialize database when app starts
-print("🔄 Initializing database...")
-if init_database():
-    print("✅ Database initialization successful")
-else:
-    print("❌ Database initialization failed")
+@bp.cli.command('init-db')
+def init_db_command():
+    """Create or migrate the database schema"""
+    init_database()
 
 # Routes
-@app.route('/')
+@bp.route('/')
+@read_only
 def index():
     try:
         # Try to get listings, but handle case where tables might not exist yet
-        featured_listings = Listing.query.filter_by(is_featured=True).order_by(Listing.created_at.desc()).limit(2).all()
-        recent_listings = Listing.query.order_by(Listing.created_at.desc()).limit(8).all()
+        if 'user_id' not in session:
+            def render_homepage():
+                featured_listings, recent_listings = homepage_listings()
+                return render_template('index.html', featured_listings=featured_listings, recent_listings=recent_listings)
+            return homepage_cache.get_or_load('html', render_homepage)
+        featured_listings, recent_listings = homepage_listings()
         return render_template('index.html', featured_listings=featured_listings, recent_listings=recent_listings)
     except Exception as e:
         print(f"⚠️ Error loading listings: {e}")
         # Return empty listings if there's an error
         return render_template('index.html', featured_listings=[], recent_listings=[])
 
-@app.route('/my_ads')
+@bp.route('/my_ads')
+@read_only
 def my_ads():
     if 'user_id' not in session:
         flash('Please login to view your ads', 'error')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     
     try:
-        user_listings = Listing.query.filter_by(user_id=session['user_id']).order_by(Listing.created_at.desc()).all()
+        user_listings = user_listings_query(session['user_id']).all()
         return render_template('my_ads.html', listings=user_listings)
     except Exception as e:
         print(f"Error loading user ads: {e}")
         flash('Error loading your ads', 'error')
         return render_template('my_ads.html', listings=[])
 
-@app.route('/rent_out', methods=['GET', 'POST'])
+@bp.route('/rent_out', methods=['GET', 'POST'])
 def rent_out():
     if request.method == 'POST':
         if 'user_id' not in session:
             flash('Please login to post an ad', 'error')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         
         title = request.form.get('title')
         description = request.form.get('description')
@@ -151,12 +1425,7 @@ def rent_out():
         
         for image in image_files:
             if image and allowed_file(image.filename):
-                filename = secure_filename(image.filename)
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_")
-                filename = timestamp + filename
-                image_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                image.save(image_path)
-                uploaded_images.append(filename)
+                uploaded_images.append(save_upload(image))
         
         try:
             new_listing = Listing(
@@ -166,16 +1435,21 @@ def rent_out():
                 rental_period=rental_period,
                 category=category,
                 location=location,
-                images=json.dumps(uploaded_images) if uploaded_images else '[]',
                 contact_number=contact_number,
                 user_id=session['user_id']
             )
             
             db.session.add(new_listing)
+            db.session.flush()
+            attach_images(new_listing, uploaded_images)
+            acquire_blobs(uploaded_images)
             db.session.commit()
+            after_commit(settle_uploads)
+            after_commit(queue_derivatives, uploaded_images)
+            after_commit(invalidate_listing_caches, listing_event(new_listing.id, [category], [location]))
             
             flash('Your rental ad has been posted successfully!', 'success')
-            return redirect(url_for('my_ads'))
+            return redirect(url_for('main.my_ads'))
         except Exception as e:
             print(f"Error creating listing: {e}")
             flash('Error creating your ad. Please try again.', 'error')
@@ -183,7 +1457,7 @@ def rent_out():
     
     return render_template('rent_out.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         email = request.form.get('email')
@@ -192,20 +1466,23 @@ def login():
         try:
             user = User.query.filter_by(email=email).first()
             
-            if user and check_password_hash(user.password, password):
+            if user and verify_password(user.password, password):
+                upgrade_password_hash(user, password)
                 session['user_id'] = user.id
                 session['username'] = user.username
                 flash('Login successful!', 'success')
-                return redirect(url_for('index'))
+                return redirect(url_for('main.index'))
             else:
                 flash('Invalid email or password', 'error')
+        except ServiceUnavailable:
+            raise
         except Exception as e:
             print(f"Login error: {e}")
             flash('Login error. Please try again.', 'error')
     
     return render_template('login.html')
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         username = request.form.get('username')
@@ -230,7 +1507,7 @@ def register():
             new_user = User(
                 username=username,
                 email=email,
-                password=generate_password_hash(password),
+                password=hash_password(password),
                 phone=phone
             )
             
@@ -238,68 +1515,113 @@ def register():
             db.session.commit()
             
             flash('Registration successful! Please login.', 'success')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
+        except ServiceUnavailable:
+            raise
         except Exception as e:
             print(f"Registration error: {e}")
             flash('Registration error. Please try again.', 'error')
     
     return render_template('register.html')
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     session.clear()
     flash('You have been logged out', 'success')
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
-@app.route('/search')
+@bp.route('/search')
+@read_only
 def search():
-    query = request.args.get('q', '')
-    location = request.args.get('location', 'Gadhinglaj')
-    category = request.args.get('category', '')
+    # Text search ignores case and spacing, and categories are lowercase, so
+    # these variants share results: the cache key and cursor scope use the
+    # normalized forms, while the page shows the query as typed. Location
+    # keeps its case: its filter is an exact match, and 'gadhinglaj' (no
+    # results) must not share a cache entry with 'Gadhinglaj'.
+    typed_query = request.args.get('q', '').strip()
+    query = normalize_search_text(typed_query)
+    location = ' '.join(request.args.get('location', 'Gadhinglaj').split())
+    category = normalize_search_text(request.args.get('category', ''))
+    cursor = request.args.get('cursor', '')
+    count_cap = current_app.config['SEARCH_COUNT_CAP']
     
     try:
-        listings_query = Listing.query
-        
-        if query:
-            listings_query = listings_query.filter(
-                db.or_(
-                    Listing.title.ilike(f'%{query}%'),
-                    Listing.description.ilike(f'%{query}%')
-                )
-            )
-        
-        if location and location != 'all':
-            listings_query = listings_query.filter(Listing.location == location)
-        
-        if category and category != 'all':
-            listings_query = listings_query.filter(Listing.category == category)
-        
-        listings = listings_query.order_by(Listing.created_at.desc()).all()
+        if cursor:
+            listings, result_count, suggestion, next_cursor = search_page(query, location, category, cursor)
+        else:
+            fresh = {}
+            def load():
+                # Like the homepage, filled from the primary so a write's
+                # eviction isn't undone by a lagging replica
+                with primary_reads():
+                    listings, result_count, suggestion, next_cursor = search_page(query, location, category, None)
+                fresh['listings'] = listings
+                return [listing.id for listing in listings], result_count, suggestion, next_cursor
+            ids, result_count, suggestion, next_cursor = search_cache.get_or_load((query, location, category), load)
+            listings = fresh['listings'] if 'listings' in fresh else listings_by_id(ids)
         
         return render_template('search.html', 
                              listings=listings, 
-                             query=query,
+                             query=typed_query,
                              location=location,
-                             category=category)
+                             category=category,
+                             suggestion=suggestion,
+                             result_count=result_count,
+                             count_capped=result_count > count_cap,
+                             count_cap=count_cap,
+                             next_cursor=next_cursor)
     except Exception as e:
         print(f"Search error: {e}")
-        return render_template('search.html', listings=[], query=query, location=location, category=category)
+        return render_template('search.html', listings=[], query=typed_query, location=location, category=category)
 
-@app.route('/edit_ad/<int:ad_id>', methods=['GET', 'POST'])
+def search_page(query, location, category, cursor):
+    """Run a search for one page. Returns its listings, the capped match
+    count, a spelling suggestion or None, and the next page's cursor or None."""
+    page_size = current_app.config['SEARCH_PAGE_SIZE']
+    listings_query = search_base_query(location, category)
+    
+    # Cursors remember whether they came from the exact or fuzzy result set
+    scope = [query, location, category]
+    fuzzy = cursor and decode_cursor(cursor, scope + ['fuzzy']) is not None
+    suggestion = None
+    
+    if fuzzy:
+        scope.append('fuzzy')
+        filtered_query, sort_keys = fuzzy_title_search(listings_query, query)
+    else:
+        scope.append('exact')
+        filtered_query, sort_keys = text_search(listings_query, query)
+    after = decode_cursor(cursor, scope) if cursor else None
+    listings, next_values = keyset_page(filtered_query, sort_keys, after, page_size)
+    
+    # Typo tolerance: retry with trigram matching on titles before giving up
+    if query and not listings and after is None and not fuzzy and has_trigram():
+        scope[-1] = 'fuzzy'
+        filtered_query, sort_keys = fuzzy_title_search(listings_query, query)
+        listings, next_values = keyset_page(filtered_query, sort_keys, None, page_size)
+        if listings and listings[0].title.lower() != query.lower():
+            suggestion = listings[0].title
+    
+    result_count = capped_count(filtered_query, current_app.config['SEARCH_COUNT_CAP']) if listings else 0
+    next_cursor = encode_cursor(scope, next_values) if next_values else None
+    return listings, result_count, suggestion, next_cursor
+
+@bp.route('/edit_ad/<int:ad_id>', methods=['GET', 'POST'])
 def edit_ad(ad_id):
     if 'user_id' not in session:
         flash('Please login to edit your ad', 'error')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     
     listing = Listing.query.get_or_404(ad_id)
     
     # Check if the current user owns this listing
     if listing.user_id != session['user_id']:
         flash('You can only edit your own ads', 'error')
-        return redirect(url_for('my_ads'))
+        return redirect(url_for('main.my_ads'))
     
     if request.method == 'POST':
         try:
+            previous_category, previous_location = listing.category, listing.location
             listing.title = request.form.get('title')
             listing.description = request.form.get('description')
             listing.category = request.form.get('category')
@@ -314,71 +1636,69 @@ def edit_ad(ad_id):
             
             for image in image_files:
                 if image and allowed_file(image.filename):
-                    filename = secure_filename(image.filename)
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_")
-                    filename = timestamp + filename
-                    image_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    image.save(image_path)
-                    uploaded_images.append(filename)
+                    uploaded_images.append(save_upload(image))
             
             if uploaded_images:
-                # Merge with existing images
-                existing_images = json.loads(listing.images) if listing.images else []
-                existing_images.extend(uploaded_images)
-                listing.images = json.dumps(existing_images)
+                # Append after the existing images
+                next_position = db.session.query(
+                    db.func.coalesce(db.func.max(ListingImage.position) + 1, 0)
+                ).filter(ListingImage.listing_id == listing.id).scalar()
+                attach_images(listing, uploaded_images, next_position)
+                acquire_blobs(uploaded_images)
             
+            event = listing_event(
+                listing.id,
+                [previous_category, listing.category],
+                [previous_location, listing.location]
+            )
             db.session.commit()
+            after_commit(settle_uploads)
+            after_commit(queue_derivatives, uploaded_images)
+            after_commit(invalidate_listing_caches, event)
             flash('Ad updated successfully!', 'success')
-            return redirect(url_for('my_ads'))
+            return redirect(url_for('main.my_ads'))
             
         except Exception as e:
             print(f"Error updating listing: {e}")
             flash('Error updating your ad. Please try again.', 'error')
     
-    # Prepare images for template
-    images = []
-    if listing.images:
-        try:
-            images = json.loads(listing.images)
-        except:
-            images = []
+    images = [photo.blob_key for photo in listing.photos]
     
     # Pass both 'listing' and 'ad' variables to template for compatibility
     return render_template('edit_ad.html', listing=listing, ad=listing, images=images)
 
-@app.route('/delete_ad/<int:ad_id>', methods=['POST'])
+@bp.route('/delete_ad/<int:ad_id>', methods=['POST'])
 def delete_ad(ad_id):
     if 'user_id' not in session:
         flash('Please login to delete your ad', 'error')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     
     listing = Listing.query.get_or_404(ad_id)
     
     # Check if the current user owns this listing
     if listing.user_id != session['user_id']:
         flash('You can only delete your own ads', 'error')
-        return redirect(url_for('my_ads'))
+        return redirect(url_for('main.my_ads'))
     
     try:
-        # Delete associated images from filesystem
-        if listing.images:
-            images = json.loads(listing.images)
-            for image in images:
-                image_path = os.path.join(app.config['UPLOAD_FOLDER'], image)
-                if os.path.exists(image_path):
-                    os.remove(image_path)
-        
+        unreferenced = release_blobs([photo.blob_key for photo in listing.photos])
+        event = listing_event(listing.id, [listing.category], [listing.location])
         db.session.delete(listing)
         db.session.commit()
+        after_commit(invalidate_listing_caches, event)
+        
+        # Only remove files once no listing refers to them
+        for key in unreferenced:
+            after_commit(remove_upload, key)
         flash('Ad deleted successfully!', 'success')
     except Exception as e:
         print(f"Error deleting listing: {e}")
         flash('Error deleting your ad. Please try again.', 'error')
     
-    return redirect(url_for('my_ads'))
+    return redirect(url_for('main.my_ads'))
 
 # Template filters
-@app.template_filter('time_ago')
+@bp.app_template_filter('time_ago')
 def time_ago_filter(dt):
     if not dt: return 'Recently'
     now = datetime.utcnow()
@@ -400,36 +1720,536 @@ def time_ago_filter(dt):
     else:
         return 'Just now'
 
-@app.template_filter('format_price')
+@bp.app_template_filter('format_price')
 def format_price_filter(price):
     return f'{price:,.0f}'
 
-@app.template_filter('get_first_image')
-def get_first_image_filter(images_json):
-    if images_json:
-        try:
-            images = json.loads(images_json)
-            if images and len(images) > 0:
-                return url_for('static', filename=f'uploads/{images[0]}')
-        except:
-            pass
+@bp.app_template_filter('cover_url')
+def cover_url_filter(cover_image):
+    if cover_image:
+        return url_for('static', filename=f'uploads/{cover_image}')
     return url_for('static', filename='images/placeholder.jpg')
 
-@app.context_processor
+@bp.app_context_processor
 def inject_user():
     return dict(session=session)
 
-@app.route('/main.css')
+@bp.route('/metrics')
+def metrics_endpoint():
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+@bp.route('/main.css')
 def serve_css():
-    return app.send_static_file('main.css')
+    return current_app.send_static_file('main.css')
 
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def not_found_error(error):
     return render_template('404.html'), 404
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def internal_error(error):
     return render_template('500.html'), 500
 
+@bp.app_errorhandler(503)
+def service_unavailable_error(error):
+    return render_template('503.html'), 503, {'Retry-After': '1'}
+
+# Admin tools
+def admin_required(view):
+    """Allow only requests bearing ADMIN_TOKEN; everyone else gets a 404"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = current_app.config['ADMIN_TOKEN']
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if not token or not hmac.compare_digest(supplied.encode(), token.encode()):
+            abort(404)
+        return view(*args, **kwargs)
+    return wrapper
+
+# Sampling profiler; one capture at a time per worker. The lock is held for
+# the whole capture and released by whichever thread finishes it.
+_profile_lock = threading.Lock()
+_request_capture = None
+
+def save_profile(app, name, sampler):
+    profile_dir = app.config['PROFILE_DIR']
+    os.makedirs(profile_dir, exist_ok=True)
+    tmp_path = os.path.join(profile_dir, f'{name}.tmp')
+    with open(tmp_path, 'w') as f:
+        f.write(sampler.collapsed())
+    os.replace(tmp_path, os.path.join(profile_dir, name))
+
+def request_capture_done(app, name, capture):
+    global _request_capture
+    try:
+        save_profile(app, name, capture.sampler)
+        print(f"🔥 Profiled {capture.finished} {capture.endpoint} requests "
+              f"({capture.sampler.samples} samples) to {name}")
+    except OSError as e:
+        print(f"❌ Could not save profile {name}: {e}")
+    finally:
+        _request_capture = None
+        _profile_lock.release()
+
+@bp.before_app_request
+def start_profiled_request():
+    capture = _request_capture
+    if capture is not None and capture.claim(request.endpoint):
+        g.profile_capture = capture
+
+@bp.teardown_app_request
+def finish_profiled_request(error):
+    capture = g.pop('profile_capture', None)
+    if capture is not None:
+        capture.release()
+
+@bp.route('/admin/profile', methods=['POST'])
+@admin_required
+def start_profile():
+    """Profile this worker for ?seconds=N and return the collapsed stacks, or
+    with ?endpoint=E&requests=K, arm a capture of the next K requests to E
+    and return the file name to fetch from /admin/profile/<name> later"""
+    global _request_capture
+    config = current_app.config
+    interval = config['PROFILE_INTERVAL_MS'] / 1000
+    endpoint = request.args.get('endpoint')
+    try:
+        seconds = min(float(request.args.get('seconds', '10')), config['PROFILE_MAX_SECONDS'])
+        request_count = int(request.args.get('requests', '10'))
+    except ValueError:
+        abort(400)
+    # A capture that can never finish would hold the lock for PROFILE_MAX_SECONDS
+    if not seconds > 0 or request_count < 1:
+        abort(400)
+    if endpoint is not None and endpoint not in current_app.view_functions:
+        abort(400)
+    if not _profile_lock.acquire(blocking=False):
+        return {'error': 'A profile capture is already running in this worker'}, 409
+    name = f'profile-{os.getpid()}-{datetime.utcnow():%Y%m%d-%H%M%S}.collapsed'
+    
+    if endpoint is not None:
+        _request_capture = profiling.RequestCapture(
+            endpoint, request_count, interval, time.monotonic() + config['PROFILE_MAX_SECONDS'],
+            functools.partial(request_capture_done, current_app._get_current_object(), name))
+        _request_capture.start()
+        return {'file': name, 'endpoint': endpoint, 'requests': request_count}, 202
+    
+    # Under sync gunicorn workers this request occupies the worker, so
+    # prefer the endpoint mode there
+    try:
+        sampler = profiling.Sampler(interval, time.monotonic() + seconds, all_threads=True,
+                                    exclude=[threading.get_ident()])
+        sampler.start()
+        time.sleep(seconds)
+        sampler.stop()
+    finally:
+        _profile_lock.release()
+    return Response(sampler.collapsed(), content_type='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename={name}'})
+
+@bp.route('/admin/profile/<name>')
+@admin_required
+def download_profile(name):
+    return send_from_directory(os.path.abspath(current_app.config['PROFILE_DIR']), name, as_attachment=True)
+
+# tracemalloc snapshots of this worker, by id, oldest first
+_memory_snapshots = {}
+_memory_snapshot_ids = itertools.count(1)
+
+def memory_report_args():
+    key_type = request.args.get('key', 'lineno')
+    try:
+        limit = int(request.args.get('limit', '20'))
+    except ValueError:
+        abort(400)
+    if key_type not in memory.KEY_TYPES:
+        abort(400)
+    return key_type, limit
+
+def tracemalloc_status():
+    traced, peak = tracemalloc.get_traced_memory()
+    return {'pid': os.getpid(), 'tracing': tracemalloc.is_tracing(), 'traced_bytes': traced,
+            'peak_bytes': peak, 'snapshots': list(_memory_snapshots)}
+
+@bp.route('/admin/tracemalloc')
+@admin_required
+def tracemalloc_info():
+    return tracemalloc_status()
+
+@bp.route('/admin/tracemalloc/start', methods=['POST'])
+@admin_required
+def start_tracemalloc():
+    """Start tracing allocations, keeping ?frames=N frames per traceback"""
+    try:
+        frames = int(request.args.get('frames', '1'))
+    except ValueError:
+        abort(400)
+    if frames < 1:
+        abort(400)
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    return tracemalloc_status()
+
+@bp.route('/admin/tracemalloc/stop', methods=['POST'])
+@admin_required
+def stop_tracemalloc():
+    """Stop tracing, freeing its traces and this worker's snapshots"""
+    tracemalloc.stop()
+    _memory_snapshots.clear()
+    return tracemalloc_status()
+
+@bp.route('/admin/tracemalloc/snapshots', methods=['POST'])
+@admin_required
+def take_memory_snapshot():
+    """Keep a snapshot (up to MEMORY_SNAPSHOTS) and return its top sites"""
+    if not tracemalloc.is_tracing():
+        return {'error': 'tracemalloc is not running in this worker'}, 409
+    key_type, limit = memory_report_args()
+    snapshot = memory.take_snapshot()
+    snapshot_id = next(_memory_snapshot_ids)
+    _memory_snapshots[snapshot_id] = snapshot
+    while len(_memory_snapshots) > current_app.config['MEMORY_SNAPSHOTS']:
+        del _memory_snapshots[next(iter(_memory_snapshots))]
+    return {'pid': os.getpid(), 'id': snapshot_id, 'top': memory.top(snapshot, key_type, limit)}
+
+@bp.route('/admin/tracemalloc/snapshots/<int:snapshot_id>')
+@admin_required
+def memory_snapshot_top(snapshot_id):
+    """Top allocation sites of a snapshot, by ?key=lineno|filename|traceback"""
+    snapshot = _memory_snapshots.get(snapshot_id) or abort(404)
+    key_type, limit = memory_report_args()
+    return {'pid': os.getpid(), 'id': snapshot_id, 'top': memory.top(snapshot, key_type, limit)}
+
+@bp.route('/admin/tracemalloc/diff')
+@admin_required
+def memory_snapshot_diff():
+    """Biggest changes from snapshot ?from=<id> to ?to=<id>, or to now"""
+    old = _memory_snapshots.get(request.args.get('from', type=int)) or abort(404)
+    to = request.args.get('to', type=int)
+    if to is None:
+        if not tracemalloc.is_tracing():
+            return {'error': 'tracemalloc is not running in this worker'}, 409
+        new = memory.take_snapshot()
+    else:
+        new = _memory_snapshots.get(to) or abort(404)
+    key_type, limit = memory_report_args()
+    return {'pid': os.getpid(), 'diff': memory.diff(old, new, key_type, limit)}
+
+@bp.route('/admin/slow-queries')
+@admin_required
+def slow_query_report():
+    """This worker's slowest statement fingerprints by total time, ?limit=N"""
+    try:
+        limit = int(request.args.get('limit', '20'))
+    except ValueError:
+        abort(400)
+    return {'pid': os.getpid(), 'threshold_ms': current_app.config['SLOW_QUERY_MS'],
+            'queries': slow_query_log.top(limit)}
+
+@bp.route('/admin/slow-queries', methods=['DELETE'])
+@admin_required
+def clear_slow_queries():
+    slow_query_log.clear()
+    return {'pid': os.getpid(), 'threshold_ms': current_app.config['SLOW_QUERY_MS'], 'queries': []}
+
+# Query plan regression check
+def explain(query):
+    """Return the plan for a query as a list of lines"""
+    sql = str(query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+    if is_postgres():
+        return [row[0] for row in db.session.execute(db.text(f'EXPLAIN {sql}'))]
+    return [row[-1] for row in db.session.execute(db.text(f'EXPLAIN QUERY PLAN {sql}'))]
+
+def plan_problems(plan):
+    """Find full scans of listing and sorts that an index should have avoided"""
+    problems = []
+    for line in plan:
+        if is_postgres():
+            if 'Seq Scan on listing' in line or re.match(r'\s*(->\s*)?(Incremental )?Sort\b', line):
+                problems.append(line.strip())
+        elif (line.startswith('SCAN listing') and 'INDEX' not in line) or 'TEMP B-TREE' in line:
+            problems.append(line.strip())
+    return problems
+
+@bp.cli.command('check-query-plans')
+def check_query_plans():
+    """EXPLAIN the hot route queries and fail on sequential scans or sorts"""
+    user = User.query.first()
+    routes = {
+        'index (featured)': featured_listings_query(),
+        'index (recent)': recent_listings_query(),
+        'my_ads': user_listings_query(user.id if user else 1),
+    }
+    for location in ('Gadhinglaj', 'all'):
+        for category in ('cars', 'all'):
+            listings_query, sort_keys = text_search(search_base_query(location, category), '')
+            routes[f'search (location={location}, category={category})'] = keyset_query(
+                listings_query, sort_keys, None, current_app.config['SEARCH_PAGE_SIZE'])
+    
+    if is_postgres():
+        # Make the planner use an index whenever one can serve the query, so
+        # small or unanalyzed tables still show which access paths exist
+        db.session.execute(db.text('SET LOCAL enable_seqscan = off'))
+        db.session.execute(db.text('SET LOCAL enable_sort = off'))
+    
+    failed = False
+    for name, query in routes.items():
+        problems = plan_problems(explain(query))
+        print(f"{'❌' if problems else '✅'} {name}")
+        for problem in problems:
+            print(f"    {problem}")
+        failed = failed or bool(problems)
+    db.session.rollback()
+    if failed:
+        raise SystemExit(1)
+
+@bp.cli.command('calibrate-password-hash')
+@click.option('--target-ms', default=250, help='Target time for one hash on this host.')
+@click.option('--scheme', type=click.Choice(['scrypt', 'pbkdf2']), default='scrypt')
+def calibrate_password_hash(target_ms, scheme):
+    """Find the PASSWORD_HASH_METHOD cost that fits a latency target"""
+    method, seconds = passwords.calibrate(target_ms / 1000, scheme)
+    print(f"PASSWORD_HASH_METHOD={method}  ({seconds * 1000:.0f} ms per hash)")
+
+@bp.cli.command('password-hash-stats')
+def password_hash_stats_command():
+    """Count users still on a hash method other than PASSWORD_HASH_METHOD"""
+    print(f"{legacy_password_hash_count()} of {User.query.count()} users have legacy hashes "
+          f"(target {current_app.config['PASSWORD_HASH_METHOD']})")
+
+# Synthetic data for load testing
+def batches(rows, size):
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, size)):
+        yield batch
+
+def bulk_insert(table, rows):
+    """Insert rows (dicts with the same keys) in one round trip: COPY on
+    PostgreSQL, executemany elsewhere"""
+    if not rows:
+        return
+    if not is_postgres():
+        db.session.execute(table.insert(), rows)
+        return
+    preparer = db.engine.dialect.identifier_preparer
+    columns = list(rows[0])
+    sql = f"COPY {preparer.format_table(table)} ({', '.join(preparer.quote(column) for column in columns)}) FROM STDIN"
+    with db.session.connection().connection.cursor() as cursor:
+        with cursor.copy(sql) as copy:
+            for row in rows:
+                copy.write_row([row[column] for column in columns])
+
+def reset_id_sequence(table):
+    """Move a PostgreSQL serial past ids that were inserted explicitly"""
+    if not is_postgres():
+        return
+    name = db.engine.dialect.identifier_preparer.format_table(table)
+    db.session.execute(db.text(f"SELECT setval(pg_get_serial_sequence(:table, 'id'), (SELECT max(id) FROM {name}))"),
+                       {'table': name})
+
+def store_placeholder_images(per_category):
+    """Upload placeholder photos for every category and build their
+    derivatives. Returns {category: [(blob key, cover path, variants JSON)]}."""
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    images = {}
+    for category in synthetic.CATEGORIES:
+        images[category] = []
+        for index in range(per_category):
+            data = synthetic.placeholder_image(category.title(), index)
+            key = save_upload(FileStorage(io.BytesIO(data), filename='placeholder.jpg'))
+            manifest = read_manifest(key) or imaging.generate_derivatives(os.path.join(upload_folder, key))
+            images[category].append((key, manifest, json.dumps(variant_paths(key, manifest))))
+    return images
+
+@bp.cli.command('generate-data')
+@click.option('--users', default=10_000, help='Sellers to create.')
+@click.option('--listings', default=100_000, help='Listings to create.')
+@click.option('--skew', default=1.0, help='Zipf exponent of listings per seller; higher means bigger power sellers.')
+@click.option('--days', default=365, help='Spread creation dates over this many past days.')
+@click.option('--images-per-category', default=4, help='Placeholder photos per category; 0 for none.')
+@click.option('--batch-size', default=10_000, help='Rows per insert and commit.')
+@click.option('--seed', default=42, help='Random seed; the same seed generates the same rows.')
+def generate_data(users, listings, skew, days, images_per_category, batch_size, seed):
+    """Bulk-insert synthetic users and listings for load testing"""
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    started = time.perf_counter()
+    
+    # Every synthetic user logs in with 'password'; hash it once, not per row
+    password_hash = generate_password_hash('password', method=current_app.config['PASSWORD_HASH_METHOD'])
+    first_user_id = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+    for batch in batches(synthetic.generate_users(rng, first_user_id, users, password_hash, now, days), batch_size):
+        bulk_insert(User.__table__, batch)
+        db.session.commit()
+    reset_id_sequence(User.__table__)
+    db.session.commit()
+    print(f"✅ {users} users")
+    
+    images = store_placeholder_images(images_per_category)
+    references = Counter()
+    seller_ids = list(range(first_user_id, first_user_id + users))
+    first_listing_id = (db.session.query(db.func.max(Listing.id)).scalar() or 0) + 1
+    rows = synthetic.generate_listings(rng, first_listing_id, listings, seller_ids, skew, now, days)
+    done = 0
+    for batch in batches(rows, batch_size):
+        image_rows = []
+        for row in batch:
+            photos = rng.sample(images[row['category']], rng.randint(1, min(3, images_per_category))) if images_per_category else []
+            row['cover_image'] = imaging.derivative_path(photos[0][0], 'thumb', 'webp') if photos else None
+            for position, (key, manifest, variants) in enumerate(photos):
+                image_rows.append({'listing_id': row['id'], 'position': position, 'blob_key': key,
+                                   'width': manifest['width'], 'height': manifest['height'], 'variants': variants})
+                references[key] += 1
+        bulk_insert(Listing.__table__, batch)
+        bulk_insert(ListingImage.__table__, image_rows)
+        db.session.commit()
+        done += len(batch)
+        print(f"🔄 {done}/{listings} listings ({done / (time.perf_counter() - started):.0f}/s)")
+    reset_id_sequence(Listing.__table__)
+    for key, count in references.items():
+        acquire_blobs([key], count)
+    db.session.commit()
+    
+    # Refresh planner statistics so the new volume is reflected in plans
+    db.session.execute(db.text('ANALYZE'))
+    db.session.commit()
+    invalidate_listing_caches(listing_event(None, synthetic.CATEGORIES, synthetic.LOCATIONS))
+    print(f"✅ {users} users and {listings} listings in {time.perf_counter() - started:.1f}s")
+
+# HTTP benchmark
+class StatementCounter:
+    """Counts SQL statements run by this process's engines"""
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+    
+    def __call__(self, *args):
+        with self._lock:
+            self.count += 1
+
+@bp.cli.command('benchmark')
+@click.option('--scenario', 'names', multiple=True, type=click.Choice(list(benchmark.SCENARIOS)),
+              help='Scenario to run; repeat for several. Defaults to all.')
+@click.option('--requests', 'request_count', default=200, help='Measured requests per scenario.')
+@click.option('--concurrency', default=8, help='Concurrent clients.')
+@click.option('--warmup', default=20, help='Unmeasured requests per scenario.')
+@click.option('--email', help='Account for logged-in scenarios; defaults to the newest listing\'s owner.')
+@click.option('--password', default='password', help='Its password (generate-data uses "password").')
+@click.option('--url', help='Benchmark a running server instead of an in-process one; queries are not counted.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the results as JSON.')
+@click.option('--baseline', type=click.Path(dir_okay=False), help='Results file to compare against; created if missing.')
+@click.option('--tolerance', default=0.2, help='Allowed fractional slowdown against the baseline.')
+def benchmark_command(names, request_count, concurrency, warmup, email, password, url, output, baseline, tolerance):
+    """Load-test the main routes over HTTP against this database.
+    
+    Seed it with `flask generate-data` first. The rent_out scenario posts
+    real listings with photo uploads.
+    """
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    newest = recent_listings_query().first()
+    if newest is None:
+        raise click.ClickException('No listings to benchmark; seed the database with `flask generate-data`')
+    email = email or newest.owner.email
+    listing_count = Listing.query.count()
+    db.session.remove()
+    
+    count_statements = None
+    if url is None:
+        counter = StatementCounter()
+        for engine in db.engines.values():
+            db.event.listen(engine, 'before_cursor_execute', counter)
+        count_statements = lambda: counter.count
+        server = make_server('127.0.0.1', 0, current_app._get_current_object(), threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_port}'
+    
+    # A new photo per request, so every upload stores and processes a new
+    # blob rather than hitting the deduplicated path
+    run_label = f'Benchmark {datetime.utcnow():%H%M%S}'
+    images = [synthetic.placeholder_image(run_label, index) for index in range(request_count + warmup)]
+    login = lambda client: client.request('POST', '/login', {'email': email, 'password': password})
+    results = {
+        'database': db.engine.dialect.name,
+        'listings': listing_count,
+        'concurrency': concurrency,
+        'started_at': datetime.utcnow().isoformat(),
+        'scenarios': {},
+    }
+    for name in names or benchmark.SCENARIOS:
+        send = benchmark.scenario_request(name, email, password, images)
+        result = benchmark.run_scenario(url, send, login if benchmark.SCENARIOS[name] else None,
+                                        request_count, concurrency, warmup, count_statements)
+        results['scenarios'][name] = result
+        queries = result['queries_per_request']
+        print(f"{name:10} {result['throughput_rps']:8.1f} req/s  p50 {result['p50_ms']:8.1f} ms  "
+              f"p95 {result['p95_ms']:8.1f} ms  p99 {result['p99_ms']:8.1f} ms  "
+              f"{'-' if queries is None else queries} queries/req  {result['errors']} errors")
+    
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if baseline is None:
+        return
+    if not os.path.exists(baseline):
+        with open(baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Saved baseline to {baseline}")
+        return
+    with open(baseline) as f:
+        regressions = benchmark.compare(results, json.load(f), tolerance)
+    for regression in regressions:
+        print(f"❌ {regression}")
+    if regressions:
+        raise SystemExit(1)
+    print(f"✅ No regressions against {baseline}")
+
+@bp.cli.command('profile')
+@click.option('--url', required=True, help='Base URL of the running server, e.g. http://127.0.0.1:8000.')
+@click.option('--seconds', default=10.0, help='Profile the worker that answers for this long.')
+@click.option('--endpoint', help='Instead profile the next requests to this endpoint, e.g. main.search.')
+@click.option('--requests', 'request_count', default=10, help='Requests to profile with --endpoint.')
+@click.option('--output', type=click.Path(dir_okay=False), help='File for the collapsed stacks.')
+def profile_command(url, seconds, endpoint, request_count, output):
+    """Capture a collapsed-stack profile from a running server (uses ADMIN_TOKEN)"""
+    import urllib.error
+    import urllib.parse
+    import urllib.request
+    headers = {'Authorization': f"Bearer {current_app.config['ADMIN_TOKEN']}"}
+    params = {'endpoint': endpoint, 'requests': request_count} if endpoint else {'seconds': seconds}
+    start = urllib.request.Request(f'{url}/admin/profile?{urllib.parse.urlencode(params)}',
+                                   method='POST', headers=headers)
+    try:
+        with urllib.request.urlopen(start, timeout=seconds + 30) as response:
+            if endpoint is None:
+                name = response.headers.get_filename()
+                body = response.read()
+            else:
+                name = json.load(response)['file']
+                print(f"🔄 Waiting for {request_count} {endpoint} requests...")
+                body = None
+    except urllib.error.HTTPError as e:
+        raise click.ClickException(f'Could not start profiling: HTTP {e.code}')
+    
+    deadline = time.monotonic() + current_app.config['PROFILE_MAX_SECONDS'] + 5
+    while body is None:
+        if time.monotonic() > deadline:
+            raise click.ClickException(f'Profile {name} never finished')
+        time.sleep(1)
+        try:
+            with urllib.request.urlopen(urllib.request.Request(f'{url}/admin/profile/{name}', headers=headers)) as response:
+                body = response.read()
+        except urllib.error.HTTPError as e:
+            if e.code != 404:
+                raise click.ClickException(f'Could not fetch profile: HTTP {e.code}')
+    
+    output = output or name
+    with open(output, 'wb') as f:
+        f.write(body)
+    print(f"✅ Saved {len(body.splitlines())} stacks to {output}")
+
 if __name__ == '__main__':
+    app = create_app()
+    verify_schema(app)
     app.run(host='0.0.0.0', port=5000, debug=False)
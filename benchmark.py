@@ -0,0 +1,171 @@
+"""HTTP load generation and reporting for `flask benchmark`.
+
+Drives a server over real HTTP with a pool of client threads, each with its
+own cookie jar, and summarizes every scenario. Nothing here imports the
+Flask app, so it can equally drive a gunicorn server in another process.
+"""
+import http.cookiejar
+import itertools
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+# Query strings cycled through by the search scenario: plain and multi-word
+# text, filters only, a filtered text search, a typo (fuzzy fallback) and a
+# query with no results
+SEARCH_MIX = [
+    {'q': 'camera'},
+    {'q': 'maruti swift'},
+    {'location': 'Gadhinglaj', 'category': 'vehicles'},
+    {'q': 'tent', 'location': 'Kolhapur'},
+    {'q': ''},
+    {'q': 'camra'},
+    {'q': 'xyzzy'},
+]
+
+RENT_OUT_FORM = {
+    'title': 'Benchmark Projector',
+    'description': 'Posted by the HTTP benchmark.',
+    'category': 'electronics',
+    'price': '500',
+    'rental_period': 'day',
+    'location': 'Gadhinglaj',
+    'contact_number': '9000000000',
+}
+
+# Scenario -> whether its clients log in first
+SCENARIOS = {'index': False, 'search': False, 'my_ads': True, 'login': False, 'rent_out': True}
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Time the request itself, not the page it redirects to
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+class Client:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect)
+
+    def request(self, method, path, fields=None, files=None):
+        """Send a request and read the whole response. Returns (status, seconds)."""
+        headers = {}
+        data = None
+        if files:
+            data, headers['Content-Type'] = encode_multipart(fields or {}, files)
+        elif fields is not None:
+            data = urllib.parse.urlencode(fields).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        started = time.perf_counter()
+        try:
+            with self.opener.open(req) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            status = e.code
+        return status, time.perf_counter() - started
+
+def encode_multipart(fields, files):
+    """Encode form fields and {name: (filename, bytes)} files as multipart/form-data"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+def scenario_request(name, email, password, images):
+    """The request function(client, i) for the i-th request of a scenario"""
+    if name == 'index':
+        return lambda client, i: client.request('GET', '/')
+    if name == 'search':
+        return lambda client, i: client.request('GET', '/search?' + urllib.parse.urlencode(SEARCH_MIX[i % len(SEARCH_MIX)]))
+    if name == 'my_ads':
+        return lambda client, i: client.request('GET', '/my_ads')
+    if name == 'login':
+        return lambda client, i: client.request('POST', '/login', {'email': email, 'password': password})
+    if name == 'rent_out':
+        return lambda client, i: client.request('POST', '/rent_out', RENT_OUT_FORM,
+                                                {'images': (f'photo{i}.jpg', images[i % len(images)])})
+    raise ValueError(f'Unknown scenario {name}')
+
+def run_scenario(base_url, send, login, requests, concurrency, warmup, count_statements=None):
+    """Send `requests` requests from `concurrency` clients after `warmup`
+    unmeasured ones. count_statements() returns the server's running SQL
+    statement count, when it is known."""
+    clients = [Client(base_url) for _ in range(concurrency)]
+    for client in clients:
+        if login is not None:
+            login(client)
+    for i in range(warmup):
+        send(clients[i % concurrency], i)
+
+    latencies = []
+    errors = []
+    counter = itertools.count()
+    lock = threading.Lock()
+
+    def worker(client):
+        while (i := next(counter)) < requests:
+            status, seconds = send(client, i)
+            with lock:
+                latencies.append(seconds)
+                if status >= 400:
+                    errors.append(status)
+
+    statements_before = count_statements() if count_statements else None
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    statements = count_statements() - statements_before if count_statements else None
+    return summarize(latencies, errors, elapsed, statements)
+
+def summarize(latencies, errors, elapsed, statements):
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(cuts[49] * 1000, 2),
+        'p95_ms': round(cuts[94] * 1000, 2),
+        'p99_ms': round(cuts[98] * 1000, 2),
+        'queries_per_request': round(statements / len(latencies), 2) if statements is not None else None,
+    }
+
+def compare(results, baseline, tolerance):
+    """Regressions of results against a baseline run, as readable lines.
+
+    p50/p95 latency and throughput may drift by the tolerance (a fraction);
+    p99 is reported but too noisy for short runs to gate on. Query counts
+    are deterministic, so any increase beyond rounding fails, as do errors
+    in a scenario that had none.
+    """
+    regressions = []
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms'):
+            if current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f'{name}: {metric} {current[metric]} > baseline {previous[metric]}')
+        if current['throughput_rps'] < previous['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {current['throughput_rps']} < baseline {previous['throughput_rps']}")
+        if None not in (current['queries_per_request'], previous['queries_per_request']) \
+                and current['queries_per_request'] > previous['queries_per_request'] + 0.5:
+            regressions.append(f"{name}: queries/request {current['queries_per_request']} > baseline {previous['queries_per_request']}")
+        if current['errors'] and not previous['errors']:
+            regressions.append(f"{name}: {current['errors']} errors, baseline had none")
+    return regressions
@@ -0,0 +1,53 @@
+# Gunicorn settings and server hooks. Run `flask --app app init-db` once per
+# deploy before starting workers; then start with plain `gunicorn`, adding
+# bind/workers on the command line as before.
+
+import os
+import tempfile
+
+wsgi_app = 'app:create_app()'
+
+# Workers share metrics through files in this directory. It must be set
+# before the app (and prometheus_client) is imported; a new one per server
+# start means no stale samples from a previous run.
+if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='rentit-metrics-')
+
+# An in-memory embedded database exists only inside the process that opened
+# it, and SQLite connections must not cross a fork
+IN_MEMORY_DB = os.environ.get('EMBEDDED_DB') == ':memory:' and not os.environ.get('DATABASE_URL')
+
+# Build the app once in the master and fork workers from it, sharing the
+# imported code copy-on-write; an in-memory database is built in the worker
+preload_app = not IN_MEMORY_DB
+
+# Threaded workers, so a worker serves requests while others wait on the
+# hash and image pools; HASH_QUEUE_DEPTH then bounds the hashes one worker
+# has in flight across its threads. Keep DB_POOL_SIZE at least this high.
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+
+def on_starting(server):
+    if IN_MEMORY_DB and server.cfg.workers > 1:
+        raise SystemExit('EMBEDDED_DB=:memory: gives every worker its own database; run a single worker')
+
+def post_fork(server, worker):
+    """Drop any connections inherited from the master; each worker opens its
+    own pool"""
+    from app import db
+    app = server.app.wsgi()
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+def post_worker_init(worker):
+    """Check the schema and open the database pool before the worker
+    accepts requests"""
+    from app import verify_schema, warm_up_pool
+    verify_schema(worker.wsgi)
+    warm_up_pool(worker.wsgi)
+
+def child_exit(server, worker):
+    """Drop a dead worker's live gauges (in-flight requests, pool usage)"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
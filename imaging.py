@@ -0,0 +1,79 @@
+"""Derivative images for listing photos.
+
+These functions run in a separate worker process, so this module must not
+import the Flask app.
+"""
+import json
+import os
+import tempfile
+import time
+
+# Variant name -> bounding box; images are shrunk to fit, never enlarged
+VARIANTS = {
+    'thumb': (480, 360),
+    'medium': (1200, 900),
+}
+
+# Extension -> (Pillow format, save options)
+FORMATS = {
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+}
+
+def derivative_path(original_path, variant, ext):
+    stem, _ = os.path.splitext(original_path)
+    return f'{stem}.{variant}.{ext}'
+
+def manifest_path(original_path):
+    stem, _ = os.path.splitext(original_path)
+    return f'{stem}.json'
+
+def derivative_files(original_path):
+    """Every file generate_derivatives() may write for an original"""
+    paths = [derivative_path(original_path, variant, ext) for variant in VARIANTS for ext in FORMATS]
+    return paths + [manifest_path(original_path)]
+
+def save_atomically(path, write):
+    # Readers check for the file's existence, so never expose a partial one.
+    # The temporary name is unique: other processes may be writing the same
+    # derivative at once.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path), suffix='.tmp')
+    os.close(fd)
+    try:
+        write(tmp_path)
+        # mkstemp creates files readable only by their owner
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def generate_derivatives(original_path):
+    """Write every variant of an uploaded image, plus a JSON manifest with the
+    dimensions of the original and of each variant. Returns the manifest."""
+    # Imported here so only the pool workers pay for loading Pillow
+    from PIL import Image, ImageOps
+    started = time.perf_counter()
+    with Image.open(original_path) as image:
+        # Phone photos are often stored sideways with an EXIF rotation flag
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        manifest = {'width': image.width, 'height': image.height, 'variants': {}}
+
+        for variant, size in VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail(size, Image.LANCZOS)
+            for ext, (image_format, options) in FORMATS.items():
+                save_atomically(derivative_path(original_path, variant, ext),
+                                lambda path: resized.save(path, image_format, **options))
+            manifest['variants'][variant] = {'width': resized.width, 'height': resized.height}
+
+    manifest['seconds'] = round(time.perf_counter() - started, 4)
+    save_atomically(manifest_path(original_path), lambda path: write_json(path, manifest))
+    return manifest
+
+def write_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f)
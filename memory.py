@@ -0,0 +1,52 @@
+"""Memory introspection for a running worker: tracemalloc snapshots, their
+top allocation sites and differences, and process-wide size readings."""
+import gc
+import os
+import tracemalloc
+
+# Frames from the machinery itself are noise in every report
+SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+]
+
+KEY_TYPES = ('lineno', 'filename', 'traceback')
+
+def take_snapshot():
+    return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+def describe(traceback, key_type):
+    if key_type == 'filename':
+        return traceback[0].filename
+    if key_type == 'lineno':
+        return f'{traceback[0].filename}:{traceback[0].lineno}'
+    return [f'{frame.filename}:{frame.lineno}' for frame in traceback]
+
+def top(snapshot, key_type='lineno', limit=20):
+    """The allocation sites holding the most memory in a snapshot"""
+    return [
+        {'site': describe(stat.traceback, key_type), 'size': stat.size, 'count': stat.count}
+        for stat in snapshot.statistics(key_type)[:limit]
+    ]
+
+def diff(old, new, key_type='lineno', limit=20):
+    """Allocation sites that grew or shrank the most between two snapshots"""
+    return [
+        {'site': describe(stat.traceback, key_type), 'size': stat.size, 'size_diff': stat.size_diff,
+         'count': stat.count, 'count_diff': stat.count_diff}
+        for stat in new.compare_to(old, key_type)[:limit]
+    ]
+
+def rss_bytes():
+    """Resident set size of this process, or None where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+def object_count():
+    """Objects tracked by the garbage collector; walks the whole heap"""
+    return len(gc.get_objects())
@@ -0,0 +1,72 @@
+"""Prometheus metrics, served by the /metrics route.
+
+Under gunicorn, gunicorn.conf.py sets PROMETHEUS_MULTIPROC_DIR before the
+app is imported. Every worker then writes its samples to files in that
+directory and /metrics aggregates them, so a scrape that lands on any one
+worker reports the whole server.
+"""
+import os
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge,
+                               Histogram, generate_latest, multiprocess)
+
+REQUEST_LATENCY = Histogram(
+    'rentit_request_duration_seconds', 'Time to serve a request',
+    ['endpoint', 'method', 'status'])
+REQUESTS_IN_PROGRESS = Gauge(
+    'rentit_requests_in_progress', 'Requests currently being served',
+    multiprocess_mode='livesum')
+
+DB_POOL_CHECKED_OUT = Gauge(
+    'rentit_db_pool_checked_out', 'Connections currently checked out of the pool',
+    ['database'], multiprocess_mode='livesum')
+DB_POOL_OVERFLOW = Gauge(
+    'rentit_db_pool_overflow', 'Connections open beyond the pool size',
+    ['database'], multiprocess_mode='livesum')
+DB_POOL_WAIT = Histogram(
+    'rentit_db_pool_wait_seconds', 'Time to check out a connection, including connecting',
+    buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30))
+QUERY_DURATION = Histogram(
+    'rentit_db_query_duration_seconds', 'SQL statement execution time',
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5))
+SLOW_QUERIES = Counter(
+    'rentit_db_slow_queries_total', 'Statements slower than SLOW_QUERY_MS',
+    ['endpoint'])
+
+UPLOAD_BYTES = Histogram(
+    'rentit_upload_bytes', 'Size of each uploaded image',
+    buckets=(10e3, 50e3, 100e3, 250e3, 500e3, 1e6, 2e6, 4e6, 8e6, 16e6))
+IMAGE_PROCESSING = Histogram(
+    'rentit_image_processing_seconds', 'Time to generate the derivatives of one upload',
+    buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 30))
+
+PASSWORD_HASH_UPGRADES = Counter(
+    'rentit_password_hash_upgrades_total', 'Hashes rewritten with PASSWORD_HASH_METHOD at login')
+# Set periodically from a count of the users table (PASSWORD_STATS_INTERVAL)
+PASSWORD_HASH_LEGACY = Gauge(
+    'rentit_password_hash_legacy_users', 'Users whose hash does not use PASSWORD_HASH_METHOD',
+    multiprocess_mode='mostrecent')
+
+# Sampled periodically in every worker; one series per worker pid
+PROCESS_RSS = Gauge(
+    'rentit_process_resident_memory_bytes', 'Resident memory of the worker',
+    multiprocess_mode='liveall')
+PYTHON_OBJECTS = Gauge(
+    'rentit_python_gc_objects', 'Objects tracked by the garbage collector in the worker',
+    multiprocess_mode='liveall')
+TRACEMALLOC_TRACED = Gauge(
+    'rentit_tracemalloc_traced_bytes', 'Memory traced by tracemalloc in the worker, 0 when not tracing',
+    multiprocess_mode='liveall')
+
+# Hit ratio: rate of result="hit" over the rate of all lookups, per cache
+CACHE_REQUESTS = Counter(
+    'rentit_cache_requests_total', 'In-process cache lookups',
+    ['cache', 'result'])
+
+def render():
+    """The exposition for every worker's metrics, and its content type"""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,45 @@
+"""Password hashing for the hashing worker pool.
+
+These functions run in a separate worker process, so this module must not
+import the Flask app.
+"""
+import statistics
+import time
+from werkzeug.security import generate_password_hash, check_password_hash
+
+def hash_password(password, method):
+    return generate_password_hash(password, method=method)
+
+def verify_password(pwhash, password):
+    return check_password_hash(pwhash, password)
+
+def time_method(method, rounds=3):
+    """Median seconds to hash one password with a werkzeug method string"""
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        generate_password_hash('benchmark-password', method=method)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+def calibrate(target_seconds, scheme='scrypt'):
+    """Pick the costliest method whose hash time stays within the target.
+
+    Returns (method, seconds). scrypt doubles N from 2**14 (memory grows with
+    it: 128 * N * r bytes); pbkdf2 scales iterations linearly from a sample.
+    """
+    if scheme == 'pbkdf2':
+        sample_iterations = 100_000
+        seconds = time_method(f'pbkdf2:sha256:{sample_iterations}')
+        iterations = max(sample_iterations, int(sample_iterations * target_seconds / seconds))
+        method = f'pbkdf2:sha256:{iterations}'
+        return method, time_method(method)
+
+    best = None
+    for log_n in range(14, 21):
+        method = f'scrypt:{2 ** log_n}:8:1'
+        seconds = time_method(method)
+        if best is not None and seconds > target_seconds:
+            break
+        best = (method, seconds)
+    return best
@@ -0,0 +1,116 @@
+"""Sampling profiler for a running worker.
+
+A Sampler thread snapshots the stacks of chosen threads at a fixed interval
+(sys._current_frames(), so profiled code runs unmodified) and counts them in
+collapsed-stack form: one "root;caller;callee count" line per distinct
+stack, as read by flamegraph.pl, speedscope and inferno.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+def frame_name(frame):
+    code = frame.f_code
+    return f'{os.path.basename(code.co_filename)}:{code.co_name}'
+
+def collapse(frame):
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+class Sampler:
+    """Samples either every thread but the excluded ones or an explicit set
+    of threads until stopped, or until a deadline"""
+    def __init__(self, interval, deadline, all_threads, exclude=()):
+        self.interval = interval
+        self.deadline = deadline
+        self.all_threads = all_threads
+        self.exclude = set(exclude)
+        self.stacks = Counter()
+        self.samples = 0
+        self._threads = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def add_thread(self, ident):
+        with self._lock:
+            self._threads.add(ident)
+
+    def remove_thread(self, ident):
+        with self._lock:
+            self._threads.discard(ident)
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval) and time.monotonic() < self.deadline:
+            frames = sys._current_frames()
+            with self._lock:
+                idents = set(frames) - self.exclude - {own} if self.all_threads else set(self._threads)
+            for ident in idents:
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.stacks[collapse(frame)] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(self.stacks.items()))
+
+class RequestCapture:
+    """Profiles the next `requests` requests to one endpoint, sampling only
+    the threads serving them. on_done(capture) is called once, when the
+    last one finishes or at the deadline."""
+    def __init__(self, endpoint, requests, interval, deadline, on_done):
+        self.endpoint = endpoint
+        self.requests = requests
+        self.started = 0
+        self.finished = 0
+        self.sampler = Sampler(interval, deadline, all_threads=False)
+        self._on_done = on_done
+        self._done = False
+        self._lock = threading.Lock()
+        self._timer = threading.Timer(max(0, deadline - time.monotonic()), self.complete)
+        self._timer.daemon = True
+
+    def start(self):
+        self.sampler.start()
+        self._timer.start()
+
+    def claim(self, endpoint):
+        """Whether to profile a request to this endpoint on the calling thread"""
+        with self._lock:
+            if self._done or endpoint != self.endpoint or self.started >= self.requests:
+                return False
+            self.started += 1
+        self.sampler.add_thread(threading.get_ident())
+        return True
+
+    def release(self):
+        """The calling thread's claimed request has finished"""
+        self.sampler.remove_thread(threading.get_ident())
+        with self._lock:
+            self.finished += 1
+            last = self.finished >= self.requests
+        if last:
+            self.complete()
+
+    def complete(self):
+        with self._lock:
+            if self._done:
+                return
+            self._done = True
+        self._timer.cancel()
+        self.sampler.stop()
+        self._on_done(self)
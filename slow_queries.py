@@ -0,0 +1,103 @@
+"""Slow SQL statements, aggregated by fingerprint.
+
+A fingerprint is a statement with literals, bind parameters and IN lists
+replaced by placeholders, so every execution of one query maps to one
+entry whatever its arguments. Only redacted parameters are kept.
+"""
+import re
+import threading
+import time
+from collections import Counter
+
+FINGERPRINT_RULES = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),                         # string literals
+    (re.compile(r'%\(\w+\)s|%s|\$\d+|(?<!:):\w+|\?'), '?'),        # bind parameters, not ::casts
+    (re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?(?:e[+-]?\d+)?\b', re.IGNORECASE), '?'),  # numbers
+    (re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE), 'IN (...)'),  # IN lists
+    (re.compile(r'\bVALUES\s*(\([^()]*\))(?:\s*,\s*\([^()]*\))+', re.IGNORECASE), r'VALUES \1'),  # multi-row inserts
+    (re.compile(r'\s+'), ' '),
+]
+
+def fingerprint(statement):
+    for pattern, replacement in FINGERPRINT_RULES:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+def redact_value(value):
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, (str, bytes)):
+        return f'<{type(value).__name__} len={len(value)}>'
+    return f'<{type(value).__name__}>'
+
+def redact(parameters, executemany=False):
+    """Parameter types and lengths, never values; the first row only for
+    executemany"""
+    if executemany:
+        rows = list(parameters or [])
+        return {'rows': len(rows), 'first': redact(rows[0]) if rows else None}
+    if isinstance(parameters, dict):
+        return {key: redact_value(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact_value(value) for value in parameters]
+    return redact_value(parameters)
+
+class SlowQueryLog:
+    """Thread-safe aggregate of statements slower than threshold seconds
+    (0 disables), keeping at most max_entries fingerprints. With explain
+    set, record() asks for one plan per fingerprint."""
+    def __init__(self, threshold=0.0, max_entries=500, explain=False):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.explain = explain
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds, endpoint, parameters, executemany=False):
+        """Add one slow execution of the statement with fingerprint key.
+        Returns True when the caller should EXPLAIN it and set_plan()."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if len(self._entries) >= self.max_entries:
+                    # Forget the fingerprint that has cost the least so far
+                    del self._entries[min(self._entries, key=lambda k: self._entries[k]['total'])]
+                entry = self._entries[key] = {
+                    'calls': 0, 'total': 0.0, 'max': 0.0, 'endpoints': Counter(), 'plan': None, 'explaining': False,
+                }
+            entry['calls'] += 1
+            entry['total'] += seconds
+            entry['max'] = max(entry['max'], seconds)
+            entry['endpoints'][endpoint] += 1
+            entry['parameters'] = redact(parameters, executemany)
+            entry['last_seen'] = time.time()
+            if not self.explain or executemany or entry['plan'] is not None or entry['explaining']:
+                return False
+            entry['explaining'] = True
+            return True
+
+    def set_plan(self, key, plan):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry['plan'] = plan
+
+    def top(self, limit=20):
+        """Entries with the highest total time, slowest first"""
+        with self._lock:
+            ranked = sorted(self._entries.items(), key=lambda item: item[1]['total'], reverse=True)[:limit]
+            return [{
+                'fingerprint': key,
+                'calls': entry['calls'],
+                'total_ms': round(entry['total'] * 1000, 1),
+                'mean_ms': round(entry['total'] / entry['calls'] * 1000, 1),
+                'max_ms': round(entry['max'] * 1000, 1),
+                'endpoints': dict(entry['endpoints'].most_common(5)),
+                'parameters': entry['parameters'],
+                'plan': entry['plan'],
+                'last_seen': entry['last_seen'],
+            } for key, entry in ranked]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,125 @@
+"""Synthetic users and listings for load tests and benchmarks.
+
+Pure data generation from a seeded random.Random, so the same arguments give
+the same rows; `flask generate-data` in app.py writes them to the database.
+"""
+import io
+import itertools
+from datetime import timedelta
+
+# Category -> (share of listings, item names, daily price range in rupees)
+CATEGORIES = {
+    'electronics': (25, ['Canon DSLR Camera', 'Sony PlayStation 5', 'JBL PartyBox Speaker',
+                         'Epson Projector', 'Dell Laptop', 'DJI Mini Drone', 'GoPro Hero'], (150, 1500)),
+    'vehicles': (20, ['Maruti Swift', 'Mahindra Bolero', 'Royal Enfield Classic 350',
+                      'Honda Activa', 'Tata Nexon', 'Tractor with Trolley'], (300, 3000)),
+    'tools': (15, ['Concrete Mixer', 'Bosch Drill Machine', 'Aluminium Ladder',
+                   'Generator 5kVA', 'Water Pump', 'Welding Machine'], (100, 1200)),
+    'furniture': (10, ['Wooden Dining Table', 'Sofa Set', 'Office Chair',
+                       'Folding Chairs (set of 10)', 'Queen Size Bed'], (50, 600)),
+    'sports': (9, ['Cricket Kit', 'Camping Tent', 'Trekking Bag', 'Badminton Set', 'Mountain Bicycle'], (50, 500)),
+    'property': (8, ['1BHK Flat', '2BHK Apartment', 'Shop Space', 'Farm House',
+                     'Marriage Hall', 'Godown'], (500, 5000)),
+    'clothing': (8, ['Wedding Sherwani', 'Designer Lehenga', 'Nauvari Saree',
+                     'Party Suit', 'Drama Costume'], (200, 2500)),
+    'other': (5, ['Event Sound System', 'Mandap Decoration', 'Catering Utensils', 'Musical Keyboard'], (100, 2000)),
+}
+
+# Location -> share of listings
+LOCATIONS = {
+    'Gadhinglaj': 40, 'Kolhapur': 20, 'Belgaum': 10, 'Nipani': 6, 'Sankeshwar': 6,
+    'Ajara': 5, 'Chandgad': 5, 'Kagal': 4, 'Other': 4,
+}
+
+# Rental period -> (share of listings, price as a multiple of the daily price)
+RENTAL_PERIODS = {'day': (60, 1), 'week': (25, 5), 'month': (15, 18)}
+
+ADJECTIVES = ['Well maintained', 'Like new', 'Affordable', 'Premium', 'Clean',
+              'Reliable', 'Spacious', 'Heavy duty', 'Branded', 'Lightly used']
+
+DESCRIPTION_SENTENCES = [
+    'Available for rent on short notice.',
+    'Pickup from my place, delivery possible for a small charge.',
+    'Deposit required, refunded on return.',
+    'Serviced regularly and in good working condition.',
+    'Ideal for weddings, festivals and family functions.',
+    'Call or WhatsApp for availability.',
+    'Discount for long-term rentals.',
+    'ID proof required at the time of handover.',
+]
+
+# Share of listings marked as featured
+FEATURED_SHARE = 0.02
+
+def cumulative(weights):
+    return list(itertools.accumulate(weights))
+
+def seller_weights(seller_count, skew):
+    """Cumulative Zipf weights: the seller at rank r gets 1 / r**skew of the
+    listings, so with skew ~1 a few power sellers own thousands of ads and
+    most sellers own one or two"""
+    return cumulative(1 / rank ** skew for rank in range(1, seller_count + 1))
+
+def generate_users(rng, first_id, count, password_hash, now, days):
+    """User rows with ids first_id.. that all share one precomputed hash"""
+    for user_id in range(first_id, first_id + count):
+        yield {
+            'id': user_id,
+            'username': f'seed{user_id}',
+            'email': f'seed{user_id}@example.com',
+            'password': password_hash,
+            'phone': f'9{rng.randrange(10 ** 9):09d}',
+            'created_at': now - timedelta(seconds=rng.randrange(days * 86400)),
+        }
+
+def generate_listings(rng, first_id, count, seller_ids, skew, now, days):
+    """Listing rows with ids first_id.., owned by seller_ids (most prolific
+    first) and created over the last `days` days"""
+    sellers = seller_weights(len(seller_ids), skew)
+    categories = list(CATEGORIES)
+    category_weights = cumulative(CATEGORIES[category][0] for category in categories)
+    locations = list(LOCATIONS)
+    location_weights = cumulative(LOCATIONS.values())
+    periods = list(RENTAL_PERIODS)
+    period_weights = cumulative(RENTAL_PERIODS[period][0] for period in periods)
+    # Each seller keeps one phone number and mostly one town
+    seller_phones = {}
+    seller_locations = {}
+
+    for listing_id in range(first_id, first_id + count):
+        seller = rng.choices(seller_ids, cum_weights=sellers)[0]
+        if seller not in seller_phones:
+            seller_phones[seller] = f'9{rng.randrange(10 ** 9):09d}'
+            seller_locations[seller] = rng.choices(locations, cum_weights=location_weights)[0]
+        location = seller_locations[seller]
+        if rng.random() < 0.1:
+            location = rng.choices(locations, cum_weights=location_weights)[0]
+        category = rng.choices(categories, cum_weights=category_weights)[0]
+        _, items, (low, high) = CATEGORIES[category]
+        item = rng.choice(items)
+        period = rng.choices(periods, cum_weights=period_weights)[0]
+        yield {
+            'id': listing_id,
+            'title': f'{rng.choice(ADJECTIVES)} {item}',
+            'description': f'{item} for rent in {location}. ' + ' '.join(rng.sample(DESCRIPTION_SENTENCES, 3)),
+            'price': float(round(rng.uniform(low, high) * RENTAL_PERIODS[period][1], -1)),
+            'rental_period': period,
+            'category': category,
+            'location': location,
+            'contact_number': seller_phones[seller],
+            'user_id': seller,
+            'created_at': now - timedelta(seconds=rng.randrange(days * 86400)),
+            'is_featured': rng.random() < FEATURED_SHARE,
+        }
+
+def placeholder_image(label, index, size=(800, 600)):
+    """JPEG bytes of a flat-colour placeholder photo with a caption"""
+    # Imported here so generating rows without images does not need Pillow
+    from PIL import Image, ImageDraw
+    hue = (index * 47) % 360
+    image = Image.new('HSV', size, (hue * 255 // 360, 90, 200)).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    draw.text((size[0] // 10, size[1] // 2), f'{label} #{index + 1}', fill='white')
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=80)
+    return buffer.getvalue()
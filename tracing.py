@@ -0,0 +1,184 @@
+"""Request-scoped tracing spans, exported as OTLP JSON.
+
+app.py starts a trace per request; span() and start_span()/end_span() add
+child spans to the current context's trace. Sampled traces are queued when
+the request ends, and write_traces() appends each to a file as one OTLP/JSON
+ExportTraceServiceRequest per line, the format the OpenTelemetry Collector's
+file exporter writes and its otlpjsonfile receiver reads.
+"""
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import queue
+import random
+import re
+import time
+
+SERVICE_NAME = 'rentit'
+
+# OTLP span kinds
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+
+TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+_current_trace = contextvars.ContextVar('trace', default=None)
+
+# Finished sampled traces waiting for write_traces(); dropped when full
+export_queue = queue.Queue(maxsize=1000)
+
+class Span:
+    __slots__ = ('name', 'kind', 'span_id', 'parent_id', 'start', 'end', 'attributes', 'error')
+
+    def __init__(self, name, kind, parent_id, attributes):
+        self.name = name
+        self.kind = kind
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = attributes
+        self.error = None
+
+class Trace:
+    def __init__(self, trace_id, sampled):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans = []
+        self.root = None
+        # Open spans, innermost last
+        self.stack = []
+        self.token = None
+
+def parse_traceparent(header):
+    """(trace id, parent span id, sampled) from a W3C traceparent header, or None"""
+    match = TRACEPARENT.match((header or '').strip().lower())
+    if match is None or match.group(1) == '0' * 32:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+def start_trace(name, sample_rate, traceparent=None, attributes=None):
+    """Begin a trace with its root server span in the current context.
+
+    Continues the caller's trace and sampling decision when given a valid
+    traceparent; otherwise samples a new trace with probability sample_rate.
+    """
+    parent = parse_traceparent(traceparent)
+    if parent:
+        trace_id, parent_id, sampled = parent
+    else:
+        trace_id, parent_id, sampled = os.urandom(16).hex(), None, random.random() < sample_rate
+    trace = Trace(trace_id, sampled)
+    trace.token = _current_trace.set(trace)
+    if sampled:
+        trace.root = Span(name, SERVER, parent_id, dict(attributes or {}))
+        trace.spans.append(trace.root)
+        trace.stack.append(trace.root)
+    return trace
+
+def current_trace():
+    return _current_trace.get()
+
+def start_span(name, attributes=None, kind=INTERNAL):
+    """Open a child of the innermost open span. Returns None when the
+    current trace is not sampled, which end_span() accepts."""
+    trace = _current_trace.get()
+    if trace is None or not trace.sampled:
+        return None
+    span = Span(name, kind, trace.stack[-1].span_id if trace.stack else None, dict(attributes or {}))
+    trace.spans.append(span)
+    trace.stack.append(span)
+    return span
+
+def end_span(span, error=None):
+    if span is None or span.end is not None:
+        return
+    span.end = time.time_ns()
+    if error is not None:
+        span.error = str(error) or type(error).__name__
+    trace = _current_trace.get()
+    if trace is not None and span in trace.stack:
+        trace.stack.remove(span)
+
+@contextlib.contextmanager
+def span(name, attributes=None, kind=INTERNAL):
+    current = start_span(name, attributes, kind)
+    try:
+        yield current
+    except BaseException as e:
+        end_span(current, e)
+        raise
+    end_span(current)
+
+def traced(name):
+    """Decorator recording each call as a span"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def finish_trace(error=None):
+    """End the current trace, closing any spans left open, and queue it for
+    export if it was sampled"""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    for open_span in reversed(list(trace.stack)):
+        end_span(open_span, error)
+    _current_trace.reset(trace.token)
+    if trace.sampled:
+        try:
+            export_queue.put_nowait(trace)
+        except queue.Full:
+            pass
+
+def attribute(key, value):
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+def to_otlp(trace):
+    """A finished trace as an OTLP/JSON ExportTraceServiceRequest"""
+    spans = []
+    for span in trace.spans:
+        otlp_span = {
+            'traceId': trace.trace_id,
+            'spanId': span.span_id,
+            'name': span.name,
+            'kind': span.kind,
+            'startTimeUnixNano': str(span.start),
+            'endTimeUnixNano': str(span.end),
+            'attributes': [attribute(key, value) for key, value in span.attributes.items()],
+            'status': {'code': 2, 'message': span.error} if span.error else {},
+        }
+        if span.parent_id:
+            otlp_span['parentSpanId'] = span.parent_id
+        spans.append(otlp_span)
+    return {'resourceSpans': [{
+        'resource': {'attributes': [attribute('service.name', SERVICE_NAME),
+                                    attribute('process.pid', os.getpid())]},
+        'scopeSpans': [{'scope': {'name': SERVICE_NAME}, 'spans': spans}],
+    }]}
+
+def write_traces(path):
+    """Append queued traces to path, one JSON line each; runs forever in a
+    daemon thread. Each line is a single append, so workers can share a file."""
+    while True:
+        trace = export_queue.get()
+        line = json.dumps(to_otlp(trace), separators=(',', ':')) + '\n'
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                os.write(fd, line.encode())
+            finally:
+                os.close(fd)
+        except OSError as e:
+            print(f"⚠️ Could not write trace {trace.trace_id}: {e}")